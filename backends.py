@@ -0,0 +1,185 @@
+"""Libraries that do the full re-encodes, each imported on first use
+
+Most jobs never re-encode: they remux, stream-copy or smart-cut with ffmpeg.
+The re-encode each operation falls back to runs on the backend that
+config.BACKENDS names for it. A backend's library is imported the first time
+a process uses it, so the bot process never loads moviepy (and numpy,
+imageio) at all, and pool workers only load it for the jobs that need it.
+"""
+import os
+from typing import Dict, List
+from config import BACKENDS
+import ffmpeg
+import ffmpeg_ops
+import progress
+import profiles
+
+class MoviepyBackend:
+    """Decodes frames in Python and re-encodes them; slow, but reads almost anything"""
+    operations = {'convert', 'merge', 'split', 'av_merge', 'audio'}
+
+    # Extension of the soundtrack moviepy encodes before muxing, per codec
+    TEMP_AUDIO = {'aac': 'm4a', 'libmp3lame': 'mp3', 'wmav2': 'wma'}
+
+    def __init__(self):
+        from moviepy.editor import VideoFileClip, AudioFileClip, concatenate_videoclips
+        from proglog import ProgressBarLogger
+        self.VideoFileClip = VideoFileClip
+        self.AudioFileClip = AudioFileClip
+        self.concatenate_videoclips = concatenate_videoclips
+
+        class Progress(ProgressBarLogger):
+            """Forwards moviepy's frame (or audio chunk) counter to the job's progress sink"""
+            def bars_callback(self, bar, attr, value, old_value=None):
+                if progress.stopped():
+                    raise RuntimeError("Cancelled")
+                if attr == 'index':
+                    total = self.bars[bar].get('total')
+                    if total:
+                        progress.report(fraction=value / total)
+
+        self.Progress = Progress
+
+    def _write(self, clip, output_path: str):
+        profile = profiles.current()
+        params = {}
+        container = os.path.splitext(output_path)[1].lstrip('.').lower()
+        if container in ffmpeg_ops.TRANSCODE_ENCODERS:
+            # moviepy only guesses codecs for a few extensions and raises for
+            # .mkv, .avi and .mov, so name them as the ffmpeg backend does
+            video_encoder, audio_encoder = ffmpeg_ops.TRANSCODE_ENCODERS[container]
+            params['codec'] = video_encoder
+            params['audio_codec'] = audio_encoder
+            # moviepy can't name a temp file for every audio codec (wmav2),
+            # and would otherwise write it to the working directory
+            params['temp_audiofile'] = f"{output_path}.audio.{self.TEMP_AUDIO[audio_encoder]}"
+            if video_encoder in ('mpeg4', 'wmv2'):
+                params['ffmpeg_params'] = ['-q:v', str(profile['qscale'])]
+            else:
+                params['ffmpeg_params'] = ['-crf', str(profile['crf'])]
+        clip.write_videofile(
+            output_path, preset=profile['preset'], threads=profile['threads'] or None,
+            verbose=False, logger=self.Progress(), **params
+        )
+
+    def convert(self, input_path: str, output_path: str):
+        clip = self.VideoFileClip(input_path)
+        self._write(clip, output_path)
+        clip.close()
+
+    def merge(self, video_paths: List[str], output_path: str):
+        clips = [self.VideoFileClip(path) for path in video_paths]
+        final_clip = self.concatenate_videoclips(clips)
+        self._write(final_clip, output_path)
+
+        for clip in clips:
+            clip.close()
+        final_clip.close()
+
+    def split(self, input_path: str, start_time: float, end_time: float, output_path: str):
+        clip = self.VideoFileClip(input_path)
+        subclip = clip.subclip(start_time, end_time)
+        self._write(subclip, output_path)
+
+        clip.close()
+        subclip.close()
+
+    def av_merge(self, video_path: str, audio_path: str, output_path: str):
+        video_clip = self.VideoFileClip(video_path)
+        audio_clip = self.AudioFileClip(audio_path)
+        final_clip = video_clip.set_audio(audio_clip)
+        self._write(final_clip, output_path)
+
+        video_clip.close()
+        audio_clip.close()
+        final_clip.close()
+
+    def audio(self, input_path: str, output_path: str, audio_format: str, copy_audio: bool):
+        clip = self.AudioFileClip(input_path)
+        # By extension moviepy would pick libfdk_aac for .m4a and nothing for .aac
+        clip.write_audiofile(
+            output_path, codec=ffmpeg_ops.AUDIO_FORMAT_ENCODERS[audio_format],
+            verbose=False, logger=self.Progress()
+        )
+        clip.close()
+
+class FFmpegBackend:
+    """Re-encodes with the ffmpeg CLI in one pass, without decoding in Python"""
+    operations = {'convert', 'merge', 'split', 'av_merge', 'audio'}
+
+    def convert(self, input_path: str, output_path: str):
+        ffmpeg_ops.transcode(input_path, output_path)
+
+    def merge(self, video_paths: List[str], output_path: str):
+        from media_probe import probe_media
+        infos = [probe_media(path) for path in video_paths]
+        # The first input with a picture sets the frame size, as in plan_merge()
+        video = next(info['video'][0] for info in infos if info['video'])
+        ffmpeg_ops.concat_encode(
+            video_paths, output_path, video['width'], video['height'],
+            [info['duration'] for info in infos], [bool(info['audio']) for info in infos]
+        )
+
+    def split(self, input_path: str, start_time: float, end_time: float, output_path: str):
+        ffmpeg_ops.transcode(input_path, output_path, start_time, end_time)
+
+    def av_merge(self, video_path: str, audio_path: str, output_path: str):
+        ffmpeg_ops.mux_encode(video_path, audio_path, output_path)
+
+    def audio(self, input_path: str, output_path: str, audio_format: str, copy_audio: bool):
+        try:
+            ffmpeg_ops.extract_audio(input_path, output_path, audio_format, copy_audio)
+        except ffmpeg.Error:
+            if copy_audio:
+                ffmpeg_ops.extract_audio(input_path, output_path, audio_format, False)
+            else:
+                raise
+
+class PydubBackend:
+    """Audio only: decodes the soundtrack to PCM and exports it"""
+    operations = {'audio'}
+
+    # pydub passes the format to ffmpeg's -f, which wants muxer names
+    FORMATS = {'m4a': 'ipod', 'aac': 'adts'}
+
+    def __init__(self):
+        from pydub import AudioSegment
+        self.AudioSegment = AudioSegment
+
+    def audio(self, input_path: str, output_path: str, audio_format: str, copy_audio: bool):
+        segment = self.AudioSegment.from_file(input_path)
+        segment.export(output_path, format=self.FORMATS.get(audio_format, audio_format))
+
+BACKEND_CLASSES = {
+    'moviepy': MoviepyBackend,
+    'ffmpeg': FFmpegBackend,
+    'pydub': PydubBackend,
+}
+
+# Backends this process has loaded, by name
+_loaded: Dict[str, object] = {}
+
+def check_config(backends: Dict[str, str]):
+    """Fail at startup, not mid-job, on a backend that can't run its operation"""
+    for operation, name in backends.items():
+        if name not in BACKEND_CLASSES:
+            raise ValueError(f"Unknown backend '{name}' for {operation}; use one of {', '.join(BACKEND_CLASSES)}")
+        if operation not in BACKEND_CLASSES[name].operations:
+            raise ValueError(f"The {name} backend can't run {operation}")
+
+def load(name: str):
+    """The named backend, importing its library on first use"""
+    backend = _loaded.get(name)
+    if backend is None:
+        backend = _loaded[name] = BACKEND_CLASSES[name]()
+    return backend
+
+def run(operation: str, *args):
+    """Re-encode for operation on its configured backend
+
+    A module-level function of picklable arguments, so it can be submitted
+    to the worker pool directly.
+    """
+    return getattr(load(BACKENDS[operation]), operation)(*args)
+
+check_config(BACKENDS)
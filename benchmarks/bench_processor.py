@@ -0,0 +1,292 @@
+"""Benchmark every VideoProcessor operation over synthetic media
+
+Inputs are generated once with ffmpeg's lavfi test sources for each codec,
+resolution and duration. Every case then runs in a fresh Python process so
+its worker pool, CPU time and peak RSS are measured in isolation.
+
+    python benchmarks/bench_processor.py --output results.json
+    python benchmarks/bench_processor.py --baseline benchmarks/baseline.json
+    python benchmarks/bench_processor.py --save-baseline benchmarks/baseline.json
+
+Comparing against a baseline exits with status 1 when any case is slower
+than the baseline by more than --threshold.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (container, ffmpeg video args, ffmpeg audio args)
+CODECS = {
+    'h264': ('mp4', ['-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p'], ['-c:a', 'aac']),
+    'mpeg4': ('avi', ['-c:v', 'mpeg4', '-q:v', '5'], ['-c:a', 'libmp3lame']),
+    'vp9': ('mkv', ['-c:v', 'libvpx-vp9', '-deadline', 'realtime', '-cpu-used', '8'], ['-c:a', 'libopus']),
+}
+
+RESOLUTIONS = {
+    '360p': '640x360',
+    '720p': '1280x720',
+    '1080p': '1920x1080',
+}
+
+def _backend(name, audio=None):
+    return {
+        'CONVERT_BACKEND': name, 'MERGE_BACKEND': name, 'SPLIT_BACKEND': name, 'AV_MERGE_BACKEND': name,
+        'AUDIO_BACKEND': audio or name,
+        # Keep converts that can't be remuxed on the backend instead of chunked ffmpeg
+        'CHUNKED_MIN_DURATION': '1e12',
+    }
+
+# Environment overrides applied to the case process before config is imported
+VARIANTS = {
+    'default': {},
+    'single': {'CHUNKED_MIN_DURATION': '1e12'},
+    'chunked': {'CHUNKED_MIN_DURATION': '0', 'CHUNK_MIN_SECONDS': '2'},
+    'moviepy': _backend('moviepy'),
+    'ffmpeg': _backend('ffmpeg'),
+    'pydub': _backend('moviepy', audio='pydub'),
+}
+
+# Converts reach the re-encode backend whenever they can't remux; audio
+# extraction always runs on it. Merges and splits of the synthetic inputs
+# never fall back, so backend variants would only repeat their default run.
+_CONVERT_VARIANTS = ('default', 'single', 'chunked', 'moviepy', 'ffmpeg')
+_AUDIO_VARIANTS = ('default', 'moviepy', 'ffmpeg', 'pydub')
+
+# name -> (VideoProcessor method, argument builder, variants it runs under)
+# Builders get the input path, its duration, a soundtrack path and the output dir.
+OPERATIONS = {
+    'convert_mp4': ('convert_video', lambda path, d, audio, out: [path, 'mp4', out], _CONVERT_VARIANTS),
+    'convert_mkv': ('convert_video', lambda path, d, audio, out: [path, 'mkv', out], _CONVERT_VARIANTS),
+    'convert_avi': ('convert_video', lambda path, d, audio, out: [path, 'avi', out], _CONVERT_VARIANTS),
+    'batch': ('batch_convert', lambda path, d, audio, out: [path, ['mp4', 'mkv'], ['mp3'], out], ('default',)),
+    'audio_mp3': ('video_to_audio', lambda path, d, audio, out: [path, 'mp3', out], _AUDIO_VARIANTS),
+    'audio_m4a': ('video_to_audio', lambda path, d, audio, out: [path, 'm4a', out], _AUDIO_VARIANTS),
+    'split': ('split_video', lambda path, d, audio, out: [path, d * 0.25, d * 0.75, out], ('default',)),
+    'split_ranges': ('split_video_ranges',
+                     lambda path, d, audio, out: [path, [[0, d / 3], [d / 3, 2 * d / 3]], out], ('default',)),
+    'split_segments': ('split_video_segments', lambda path, d, audio, out: [path, d / 4, out], ('default',)),
+    'merge': ('merge_videos', lambda path, d, audio, out: [[path, path], out], ('default',)),
+    'av_merge': ('merge_video_audio', lambda path, d, audio, out: [path, audio, out], ('default',)),
+}
+
+def _csv(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+def _ffmpeg(args):
+    subprocess.run(['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', *args], check=True)
+
+def generate_inputs(media_dir, codecs, resolutions, durations):
+    """Create (or reuse) one synthetic clip per combination; returns input descriptors"""
+    os.makedirs(media_dir, exist_ok=True)
+    inputs = []
+    for duration in durations:
+        audio_path = os.path.join(media_dir, f"tone_{duration:g}s.m4a")
+        if not os.path.exists(audio_path):
+            _ffmpeg(['-f', 'lavfi', '-i', f"sine=frequency=330:sample_rate=48000:duration={duration}",
+                     '-c:a', 'aac', audio_path])
+        for codec in codecs:
+            container, video_args, audio_args = CODECS[codec]
+            for resolution in resolutions:
+                path = os.path.join(media_dir, f"{codec}_{resolution}_{duration:g}s.{container}")
+                if not os.path.exists(path):
+                    _ffmpeg([
+                        '-f', 'lavfi', '-i', f"testsrc2=size={RESOLUTIONS[resolution]}:rate=30:duration={duration}",
+                        '-f', 'lavfi', '-i', f"sine=frequency=440:sample_rate=48000:duration={duration}",
+                        *video_args, '-g', '60', *audio_args, '-shortest', path,
+                    ])
+                inputs.append({
+                    'path': path, 'audio': audio_path, 'codec': codec,
+                    'resolution': resolution, 'duration': duration,
+                })
+    return inputs
+
+def _dir_bytes(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(path) for name in files
+    )
+
+def run_case(case):
+    """Run one operation in this process and return its measurements"""
+    sys.path.insert(0, ROOT)
+    import asyncio
+    from video_processor import VideoProcessor
+    from executor import job_executor
+
+    method, build_args, _ = OPERATIONS[case['operation']]
+    output_dir = tempfile.mkdtemp(prefix="bench_out_")
+    args = build_args(case['path'], case['duration'], case['audio'], output_dir)
+
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+    try:
+        asyncio.run(getattr(VideoProcessor, method)(*args))
+        wall = time.perf_counter() - started
+    finally:
+        # Reap the pool so its CPU time and peak RSS land in RUSAGE_CHILDREN
+        job_executor.shutdown(wait=True)
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    cpu = sum(
+        (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime)
+        for before, after in ((self_before, self_after), (children_before, children_after))
+    )
+    output_bytes = _dir_bytes(output_dir)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    return {
+        'wall_s': wall,
+        'cpu_s': cpu,
+        # ru_maxrss is in KiB on Linux; the largest single process, not a sum
+        'peak_rss_mb': max(self_after.ru_maxrss, children_after.ru_maxrss) / 1024,
+        'output_bytes': output_bytes,
+        'disk_write_bytes': (self_after.ru_oublock - self_before.ru_oublock
+                             + children_after.ru_oublock - children_before.ru_oublock) * 512,
+        'realtime_factor': case['duration'] / wall if wall else None,
+    }
+
+def case_env(overrides=None):
+    """Environment for a case process: this one's, plus overrides, with the repo importable"""
+    env = dict(os.environ, **(overrides or {}))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    return env
+
+def spawn_case(script, case, scratch_dir, overrides=None):
+    """Run `script --case case` in a fresh interpreter and return the JSON it prints last"""
+    # config.py creates its temp and data dirs relative to the working directory
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(script), '--case', case],
+        cwd=scratch_dir, env=case_env(overrides), capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "case failed")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def summarize(record, runs):
+    """Fill record from repeated runs of one case"""
+    # The median run by wall time stands for the case
+    runs = sorted(runs, key=lambda run: run['wall_s'])
+    record.update(runs[len(runs) // 2])
+    record['wall_s_min'] = runs[0]['wall_s']
+    record['wall_s_stdev'] = statistics.pstdev(run['wall_s'] for run in runs)
+    return record
+
+def case_key(result):
+    return (f"{result['operation']}[{result['variant']}]/{result['codec']}/"
+            f"{result['resolution']}/{result['duration']:g}s")
+
+def run_suite(args):
+    inputs = generate_inputs(args.media_dir, args.codecs, args.resolutions, args.durations)
+    results = []
+    scratch_dir = tempfile.mkdtemp(prefix="bench_run_")
+    try:
+        for item in inputs:
+            for operation in args.operations:
+                allowed = OPERATIONS[operation][2]
+                for variant in ([v for v in args.variants if v in allowed] or ['default']):
+                    case = json.dumps({'operation': operation, **item})
+                    record = {'operation': operation, 'variant': variant, 'codec': item['codec'],
+                              'resolution': item['resolution'], 'duration': item['duration']}
+                    runs = []
+                    try:
+                        for _ in range(args.repeat):
+                            runs.append(spawn_case(__file__, case, scratch_dir, VARIANTS[variant]))
+                    except RuntimeError as e:
+                        record['error'] = str(e)
+                        print(f"{case_key(record):45} FAILED: {e}", flush=True)
+                        results.append(record)
+                        continue
+
+                    results.append(summarize(record, runs))
+                    print(f"{case_key(record):45} {record['wall_s']:8.2f}s wall {record['cpu_s']:8.2f}s cpu "
+                          f"{record['peak_rss_mb']:7.1f}MB rss {record['realtime_factor']:6.1f}x", flush=True)
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    return results
+
+def _metadata():
+    def output(cmd):
+        try:
+            return subprocess.run(cmd, capture_output=True, text=True, cwd=ROOT).stdout.strip()
+        except OSError:
+            return None
+    ffmpeg_version = output(['ffmpeg', '-version'])
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': output(['git', 'rev-parse', '--short', 'HEAD']),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'ffmpeg': ffmpeg_version.splitlines()[0] if ffmpeg_version else None,
+    }
+
+def _seconds(value):
+    return f"{value:8.2f}s"
+
+def compare(results, baseline, threshold, key=case_key, width=45, fmt=_seconds):
+    """Print wall-time changes against the baseline; returns the regressed keys"""
+    previous = {key(record): record for record in baseline['results'] if 'error' not in record}
+    regressions = []
+    for record in results:
+        name = key(record)
+        before = previous.get(name)
+        if before is None or 'error' in record:
+            continue
+        change = record['wall_s'] / before['wall_s'] - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:{width}} {fmt(before['wall_s'])} -> {fmt(record['wall_s'])} ({change:+.1%}){flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    parser.add_argument('--operations', type=_csv, default=list(OPERATIONS))
+    parser.add_argument('--variants', type=_csv, default=list(VARIANTS))
+    parser.add_argument('--codecs', type=_csv, default=['h264', 'mpeg4'])
+    parser.add_argument('--resolutions', type=_csv, default=['360p', '720p'])
+    parser.add_argument('--durations', type=lambda value: [float(d) for d in _csv(value)], default=[10.0, 60.0])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--media-dir', default=os.path.join(tempfile.gettempdir(), "bench_media"))
+    parser.add_argument('--output', help="write results JSON here")
+    parser.add_argument('--baseline', help="compare wall times against this results JSON")
+    parser.add_argument('--save-baseline', help="also write the results here as the new baseline")
+    parser.add_argument('--threshold', type=float, default=0.10, help="allowed slowdown (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+        return
+
+    for name, known in (('operations', OPERATIONS), ('variants', VARIANTS),
+                        ('codecs', CODECS), ('resolutions', RESOLUTIONS)):
+        unknown = set(getattr(args, name)) - set(known)
+        if unknown:
+            parser.error(f"unknown {name}: {', '.join(sorted(unknown))}")
+
+    report = {'meta': _metadata(), 'results': run_suite(args)}
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(report['results'], baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
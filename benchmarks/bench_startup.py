@@ -0,0 +1,146 @@
+"""Benchmark cold start: module import time, backend load time and RSS
+
+Each target runs in a fresh Python process, the way a redeploy or a newly
+spawned pool worker pays for it. 'bot' is everything imported before main()
+starts talking to Telegram. 'video_processor' is what a pool worker loads to
+run its first task, since main.py gives it nothing else to import, and
+'worker' is a worker.py process. 'backend:<name>' is the extra cost the
+first job to need that backend pays in its worker.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --importtime bot
+    python benchmarks/bench_startup.py --baseline benchmarks/startup_baseline.json
+
+Comparing against a baseline exits with status 1 when any target is slower
+than the baseline by more than --threshold.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import subprocess
+import tempfile
+from bench_processor import _metadata, case_env, spawn_case, summarize, compare
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> modules imported by the case process
+MODULES = {
+    'config': ['config'],
+    'video_processor': ['video_processor'],
+    'worker': ['worker'],
+    'bot': ['bot'],
+}
+BACKENDS = ['moviepy', 'ffmpeg', 'pydub']
+TARGETS = list(MODULES) + [f"backend:{name}" for name in BACKENDS]
+
+def run_case(target):
+    """Import (or load) target in this process and return its measurements"""
+    import importlib
+    sys.path.insert(0, ROOT)
+    started = time.perf_counter()
+    if target.startswith('backend:'):
+        import backends
+        started = time.perf_counter()
+        backends.load(target.split(':', 1)[1])
+    else:
+        for module in MODULES[target]:
+            importlib.import_module(module)
+    return {
+        'import_s': time.perf_counter() - started,
+        # ru_maxrss is in KiB on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'modules': len(sys.modules),
+        'done_at': time.time(),
+    }
+
+def _spawn_case(target, scratch_dir):
+    spawned = time.time()
+    record = spawn_case(__file__, target, scratch_dir)
+    # Interpreter start included: what a user waits for after a redeploy
+    record['wall_s'] = record.pop('done_at') - spawned
+    return record
+
+def importtime(target, scratch_dir, top):
+    """Print the slowest imports of target by cumulative time (python -X importtime)"""
+    module = MODULES[target][0] if target in MODULES else 'backends'
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        cwd=scratch_dir, env=case_env(), capture_output=True, text=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len('import time:'):].split('|')]
+        rows.append((int(cumulative), name))
+    for cumulative, name in sorted(rows, reverse=True)[:top]:
+        print(f"{cumulative / 1000:10.1f}ms  {name}")
+
+def run_suite(targets, repeat, scratch_dir):
+    results = []
+    for target in targets:
+        record = {'target': target}
+        try:
+            runs = [_spawn_case(target, scratch_dir) for _ in range(repeat)]
+        except RuntimeError as e:
+            record['error'] = str(e)
+            print(f"{target:20} FAILED: {e}", flush=True)
+            results.append(record)
+            continue
+
+        results.append(summarize(record, runs))
+        print(f"{target:20} {record['wall_s'] * 1000:8.0f}ms wall {record['import_s'] * 1000:8.0f}ms import "
+              f"{record['peak_rss_mb']:7.1f}MB rss {record['modules']:5} modules", flush=True)
+    return results
+
+def _milliseconds(value):
+    return f"{value * 1000:8.0f}ms"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    parser.add_argument('--targets', type=lambda value: [t.strip() for t in value.split(',') if t.strip()],
+                        default=TARGETS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--importtime', metavar='TARGET', help="list the slowest imports of one target")
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--output', help="write results JSON here")
+    parser.add_argument('--baseline', help="compare wall times against this results JSON")
+    parser.add_argument('--save-baseline', help="also write the results here as the new baseline")
+    parser.add_argument('--threshold', type=float, default=0.10, help="allowed slowdown (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(args.case)))
+        return
+
+    unknown = set(args.targets + ([args.importtime] if args.importtime else [])) - set(TARGETS)
+    if unknown:
+        parser.error(f"unknown targets: {', '.join(sorted(unknown))}")
+
+    scratch_dir = tempfile.mkdtemp(prefix="bench_startup_")
+    try:
+        if args.importtime:
+            importtime(args.importtime, scratch_dir, args.top)
+            return
+        report = {'meta': _metadata(), 'results': run_suite(args.targets, args.repeat, scratch_dir)}
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(report['results'], baseline, args.threshold,
+                   key=lambda record: record['target'], width=20, fmt=_milliseconds):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""Stand-in for a local Bot API server, to exercise LOCAL_BOT_API_URL offline
+
+Answers the Bot API methods the bot uses the way a `telegram-bot-api --local`
+server does: getFile returns an absolute path on this machine, and uploads
+are accepted as file:// references. Nothing talks to Telegram, and /stats
+shows whether the bot read inputs in place and sent results by reference or
+fell back to copying bytes over HTTP.
+
+    python benchmarks/local_bot_api.py --port 8081 --send clip.mp4 &
+    LOCAL_BOT_API_URL=http://localhost:8081 BOT_TOKEN=123:offline python bot.py
+    curl http://localhost:8081/stats
+
+--send queues a message carrying that file as a document, as if a user had
+sent it. Further updates (a button press, a reply) can be POSTed as JSON to
+/updates; update_id is filled in. An upload sent as bytes rather than by
+reference is counted in /stats, and one over 1MB is refused outright.
+"""
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import logging
+from email.parser import BytesParser
+from email.policy import HTTP
+from typing import Dict, List
+from urllib.parse import parse_qsl, unquote, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from webhook import WebhookServer, Response
+
+logger = logging.getLogger(__name__)
+
+_FILE_URI = re.compile(r'file://[^"\s,]+')
+
+BOT = {'id': 1, 'is_bot': True, 'first_name': "Offline", 'username': "offline_bot"}
+
+def _json(payload, status: int = 200) -> Response:
+    return status, "application/json", json.dumps(payload).encode()
+
+def _ok(result) -> Response:
+    return _json({'ok': True, 'result': result})
+
+def _error(description: str) -> Response:
+    return _json({'ok': False, 'error_code': 400, 'description': description}, 400)
+
+def _file(path: str) -> Dict:
+    return {
+        'file_id': path,
+        'file_unique_id': hashlib.sha1(path.encode()).hexdigest()[:16],
+        'file_size': os.path.getsize(path),
+    }
+
+def _params(headers: Dict[str, str], body: bytes) -> Dict:
+    content_type = headers.get('content-type', '')
+    if content_type.startswith('application/json'):
+        return json.loads(body or b'{}')
+    if content_type.startswith('multipart/form-data'):
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + body
+        )
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            payload = part.get_payload(decode=True)
+            params[name] = payload if part.get_filename() else payload.decode()
+        return params
+    return dict(parse_qsl(body.decode()))
+
+class LocalBotApi:
+    """The Bot API state: queued updates, sent messages and what was copied"""
+    def __init__(self):
+        self.updates: List[Dict] = []
+        self._next_update = 1
+        self._next_message = 1
+        self._updated = asyncio.Event()
+        self.stats = {
+            'files_in_place': 0,
+            'uploads_by_reference': 0,
+            'uploads_by_bytes': 0,
+            'uploaded_bytes': 0,
+            'downloaded_bytes': 0,
+        }
+
+    def queue_update(self, update: Dict):
+        update['update_id'] = self._next_update
+        self._next_update += 1
+        self.updates.append(update)
+        self._updated.set()
+
+    def document_update(self, path: str, chat_id: int):
+        path = os.path.abspath(path)
+        document = dict(_file(path), file_name=os.path.basename(path), mime_type='video/mp4')
+        self.queue_update({'message': self._message(chat_id, document=document)})
+
+    def _message(self, chat_id, sender: Dict = None, **content) -> Dict:
+        message = {
+            'message_id': self._next_message,
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private'},
+            'from': sender or {'id': int(chat_id), 'is_bot': False, 'first_name': "Offline"},
+        }
+        self._next_message += 1
+        message.update(content)
+        return message
+
+    async def _get_updates(self, params: Dict):
+        offset = int(params.get('offset') or 0)
+        self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        if not self.updates:
+            self._updated.clear()
+            try:
+                await asyncio.wait_for(self._updated.wait(), min(float(params.get('timeout') or 0), 1.0))
+            except asyncio.TimeoutError:
+                pass
+        return self.updates
+
+    def _send(self, method: str, params: Dict):
+        references = []
+        for name, value in params.items():
+            if isinstance(value, bytes):
+                self.stats['uploads_by_bytes'] += 1
+                self.stats['uploaded_bytes'] += len(value)
+            elif isinstance(value, str):
+                references += [unquote(urlparse(uri).path) for uri in _FILE_URI.findall(value)]
+        for path in references:
+            if not os.path.isfile(path):
+                raise FileNotFoundError(path)
+        self.stats['uploads_by_reference'] += len(references)
+
+        chat_id = params.get('chat_id', 0)
+        if method == 'sendMediaGroup':
+            return [self._message(chat_id, BOT, document=_file(path)) for path in references]
+        if references:
+            return self._message(chat_id, BOT, document=_file(references[0]))
+        return self._message(chat_id, BOT, text=params.get('text', ""))
+
+    async def call(self, method: str, params: Dict):
+        if method == 'getMe':
+            return BOT
+        if method == 'getUpdates':
+            return await self._get_updates(params)
+        if method == 'getFile':
+            path = params['file_id']
+            if not os.path.isfile(path):
+                raise FileNotFoundError(path)
+            self.stats['files_in_place'] += 1
+            return dict(_file(path), file_path=path)
+        if method.startswith(('send', 'edit')):
+            return self._send(method, params)
+        # setWebhook, deleteMessage, answerCallbackQuery and the like
+        return True
+
+class LocalBotApiServer(WebhookServer):
+    """Routes /bot<token>/<method> for any token, plus /updates and /stats"""
+    def __init__(self, api: LocalBotApi, host: str, port: int):
+        super().__init__(host, port)
+        self.api = api
+
+    async def _dispatch(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> Response:
+        if path == '/stats':
+            return _json(self.api.stats)
+        if path == '/updates' and method == 'POST':
+            self.api.queue_update(json.loads(body))
+            return _ok(True)
+        if path.startswith('/file/bot'):
+            # What a client outside local mode would download over HTTP
+            file_path = '/' + path.split('/', 3)[3].lstrip('/')
+            try:
+                with open(file_path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                return _json({'ok': False, 'error_code': 404, 'description': "Not Found"}, 404)
+            self.api.stats['downloaded_bytes'] += len(data)
+            return 200, "application/octet-stream", data
+
+        parts = path.strip('/').split('/')
+        if len(parts) != 2 or not parts[0].startswith('bot'):
+            return _json({'ok': False, 'error_code': 404, 'description': "Not Found"}, 404)
+        try:
+            return _ok(await self.api.call(parts[1], _params(headers, body)))
+        except (FileNotFoundError, KeyError, ValueError) as e:
+            logger.warning(f"{parts[1]} failed: {e!r}")
+            return _error(f"Bad Request: {e}")
+
+async def serve(args):
+    api = LocalBotApi()
+    for path in args.send:
+        api.document_update(path, args.chat_id)
+    server = LocalBotApiServer(api, args.host, args.port)
+    await server.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--send', action='append', default=[], metavar='PATH',
+                        help="queue a message carrying this file (repeatable)")
+    parser.add_argument('--chat-id', type=int, default=1000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,16 @@
 import os
+import re
+import math
+import zipfile
 import logging
 from telegram import (
     Update, 
     InlineKeyboardButton, 
     InlineKeyboardMarkup,
-    InputFile
+    InputFile,
+    InputMediaVideo
 )
+from telegram.error import BadRequest
 from telegram.ext import (
     Application, 
     CommandHandler, 
@@ -14,11 +19,29 @@ from telegram.ext import (
     ContextTypes,
     filters
 )
-from config import BOT_TOKEN, MAX_FILE_SIZE, SUPPORTED_VIDEO_FORMATS, SUPPORTED_AUDIO_FORMATS
+from config import (
+    BOT_TOKEN, MAX_DOWNLOAD_SIZE, MAX_SPLIT_CLIPS, SUPPORTED_VIDEO_FORMATS, SUPPORTED_AUDIO_FORMATS,
+    LOCAL_BOT_API_URL, BOT_MODE
+)
 from user_manager import user_manager
 from video_processor import VideoProcessor
+from executor import job_executor
+from progress_reporter import ProgressReporter
+from result_cache import result_cache
+from input_store import input_store
+from media_probe import probe_media
+from scheduler import job_scheduler, estimate_cost, JobRejected
+from profiles import choose_profile
+from workspace import workspace_manager
+from webhook import run_webhook
+from jobs import job_runner
+import metrics
+from metrics import track_job, phase, instrument
+import time
 import asyncio
 import aiofiles
+from pathlib import Path
+from contextlib import AsyncExitStack
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -37,9 +60,24 @@ MAIN_MENU = [
     [
         InlineKeyboardButton("Video Split", callback_data="split_menu"),
         InlineKeyboardButton("Video to Audio Converter", callback_data="audio_menu")
+    ],
+    [
+        InlineKeyboardButton("Batch Converter (several formats)", callback_data="batch_menu")
     ]
 ]
 
+MERGE_MENU = [
+    [InlineKeyboardButton("➕ Add More", callback_data="add_more_merge")],
+    [InlineKeyboardButton("🚀 Process Merge", callback_data="process_merge")],
+    [InlineKeyboardButton("🔙 Back", callback_data="main_menu")]
+]
+
+AV_MERGE_MENU = [
+    [InlineKeyboardButton("✂️ Stop at shortest", callback_data="avmerge_shortest")],
+    [InlineKeyboardButton("🔇 Pad audio to video length", callback_data="avmerge_pad")],
+    [InlineKeyboardButton("🔙 Back", callback_data="main_menu")]
+]
+
 # Format selection keyboards
 VIDEO_FORMATS = [
     [InlineKeyboardButton("MP4", callback_data="format_mp4"),
@@ -57,6 +95,155 @@ AUDIO_FORMATS = [
     [InlineKeyboardButton("🔙 Back", callback_data="main_menu")]
 ]
 
+def input_ref(media, ext: str) -> dict:
+    """What we need to (re)fetch a Telegram file through the input store"""
+    return {'file_id': media.file_id, 'file_unique_id': media.file_unique_id, 'ext': ext}
+
+def telegram_download(bot, ref: dict):
+    async def download(path):
+        with phase('download'):
+            file = await bot.get_file(ref['file_id'])
+            if LOCAL_BOT_API_URL and os.path.isfile(file.file_path):
+                # A local server already has the file on our disk; use it in place
+                return file.file_path
+            await file.download_to_drive(path)
+            metrics.DOWNLOAD_BYTES.inc(os.path.getsize(path), operation=metrics.current_operation())
+    return download
+
+def use_input(bot, ref: dict):
+    """Local path for ref, downloaded once and pinned while the block runs"""
+    return input_store.use(ref['file_unique_id'], ref['ext'], telegram_download(bot, ref))
+
+async def run_job(user_id, operation, input_paths, progress_callback, method, *args):
+    """Run VideoProcessor.<method>(*args) through the fair scheduler
+
+    Shows the queue position while the job waits. The job itself runs here
+    or on a worker, depending on JOB_BACKEND. Returns the method's result
+    and the encoding profile its encodes used (None if nothing was encoded).
+    """
+    with phase('probe'):
+        infos = await asyncio.gather(*(asyncio.to_thread(probe_media, path) for path in input_paths))
+    cost = estimate_cost(operation, infos)
+    profile = choose_profile(operation, infos, job_scheduler.queued)
+    
+    async def on_position(position):
+        await progress_callback(0, f"⏳ Waiting in queue (position {position})...")
+    
+    reply = {'user_id': user_id, 'chat_id': progress_callback.chat_id, 'message_id': progress_callback.message_id}
+    queued_at = time.time()
+    
+    async def job():
+        metrics.record_phase('queue', queued_at, time.time())
+        with phase('encode', method=method, profile=profile):
+            return await job_runner.run(method, args, progress_callback, reply, profile)
+    
+    outcome = await job_scheduler.run(user_id, cost, job, on_position)
+    if outcome['profile'] is not None:
+        # Counted once an encode used it: remuxes and copies pick one too
+        metrics.PROFILES.inc(operation=operation, profile=outcome['profile'])
+    return outcome['result'], outcome['profile']
+
+def profile_caption(caption, profile):
+    """caption with the encoding profile a fresh result was made with"""
+    return f"{caption}\n⚙️ Profile: {profile}" if profile else caption
+
+async def read_upload(path, filename=None):
+    """What to pass as the file of a send_* call for a local path
+
+    A local Bot API server gets a file:// reference and reads the file from
+    disk itself. Otherwise the bytes are read without blocking the event loop.
+    """
+    if LOCAL_BOT_API_URL:
+        if filename and filename != os.path.basename(path):
+            # The server names the upload after the file, so link it under the name we want
+            named = os.path.join(os.path.dirname(path), os.path.basename(filename))
+            if not os.path.exists(named):
+                os.link(path, named)
+            path = named
+        return Path(os.path.abspath(path)).as_uri()
+    
+    # InputFile would read a file object synchronously, stalling every
+    # other chat for the length of a multi-GB read
+    async with aiofiles.open(path, 'rb') as file:
+        return InputFile(await file.read(), filename=filename or os.path.basename(path))
+
+async def send_result(bot, chat_id, kind, output_path, caption, filename=None, cache_key=None):
+    """Upload a finished file as document/video/audio and cache its file_id"""
+    with phase('upload', kind=kind):
+        message = await getattr(bot, f"send_{kind}")(
+            chat_id=chat_id,
+            caption=caption,
+            **{kind: await read_upload(output_path, filename)}
+        )
+    metrics.UPLOAD_BYTES.inc(os.path.getsize(output_path), operation=metrics.current_operation())
+    
+    # Telegram may store a video or audio as a plain document
+    sent = message.video or message.audio or message.document
+    if sent is not None:
+        sent_kind = 'video' if message.video else 'audio' if message.audio else 'document'
+        result_cache.put(cache_key, sent_kind, sent.file_id)
+    return message
+
+def _zip_files(paths, zip_path):
+    # Videos are already compressed; storing is as small and much faster
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as archive:
+        for path in paths:
+            archive.write(path, os.path.basename(path))
+
+async def send_clips(bot, chat_id, clip_paths, caption):
+    """Send clips as an album, or as a single zip when they don't fit in one"""
+    if len(clip_paths) == 1:
+        await send_result(bot, chat_id, 'video', clip_paths[0], caption)
+    elif len(clip_paths) <= 10:
+        with phase('upload', kind='album'):
+            uploads = await asyncio.gather(*(read_upload(path) for path in clip_paths))
+            media = [
+                InputMediaVideo(upload, caption=caption if i == 0 else None)
+                for i, upload in enumerate(uploads)
+            ]
+            await bot.send_media_group(chat_id=chat_id, media=media)
+        metrics.UPLOAD_BYTES.inc(
+            sum(os.path.getsize(path) for path in clip_paths), operation=metrics.current_operation()
+        )
+    else:
+        zip_path = os.path.join(os.path.dirname(clip_paths[0]), "clips.zip")
+        await asyncio.to_thread(_zip_files, clip_paths, zip_path)
+        try:
+            await send_result(bot, chat_id, 'document', zip_path, caption, filename="clips.zip")
+        finally:
+            os.unlink(zip_path)
+
+async def send_cached_result(bot, chat_id, cache_key, caption) -> bool:
+    """Re-send a previously uploaded result by file_id, if one is cached"""
+    cached = result_cache.get(cache_key)
+    if cached is None:
+        return False
+    
+    kind, file_id = cached
+    try:
+        await getattr(bot, f"send_{kind}")(chat_id=chat_id, caption=caption, **{kind: file_id})
+    except BadRequest as e:
+        logger.warning(f"Cached file_id rejected, re-encoding: {e}")
+        result_cache.delete(cache_key)
+        return False
+    return True
+
+def batch_keyboard(selected):
+    """VIDEO_FORMATS and AUDIO_FORMATS as toggles, ticking the selected ones"""
+    rows = []
+    for keyboard in (VIDEO_FORMATS, AUDIO_FORMATS):
+        for row in keyboard[:-1]:
+            rows.append([
+                InlineKeyboardButton(
+                    f"✅ {button.text}" if button.callback_data in selected else button.text,
+                    callback_data=f"batch_{button.callback_data}"
+                )
+                for button in row
+            ])
+    rows.append([InlineKeyboardButton("🚀 Convert Selected", callback_data="batch_run")])
+    rows.append([InlineKeyboardButton("🔙 Back", callback_data="main_menu")])
+    return InlineKeyboardMarkup(rows)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send welcome message and main menu"""
     welcome_text = """
@@ -80,14 +267,20 @@ async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle incoming video files"""
     user_id = update.message.from_user.id
     
-    # Download the file
-    file = await update.message.video.get_file()
-    file_path = f"temp_files/{user_id}_{update.message.video.file_id}.mp4"
-    await file.download_to_drive(file_path)
+    if update.message.video.file_size and update.message.video.file_size > MAX_DOWNLOAD_SIZE:
+        await update.message.reply_text(f"❌ File too large! Maximum size is {MAX_DOWNLOAD_SIZE // (1024 * 1024)}MB.")
+        return
+    
+    # Download the file (shared with anyone who sent the same media)
+    ref = input_ref(update.message.video, '.mp4')
+    await input_store.fetch(ref['file_unique_id'], ref['ext'], telegram_download(context.bot, ref))
     
-    # Store file info in user context
-    context.user_data['current_file'] = file_path
-    context.user_data['file_type'] = 'video'
+    # Store file info in the user's session
+    user_manager.update(user_id, current_file=ref, file_type='video')
+    
+    if user_manager.get_user_state(user_id) == "awaiting_merge_files":
+        await add_merge_file(update, ref)
+        return
     
     # Show main menu
     keyboard = InlineKeyboardMarkup(MAIN_MENU)
@@ -112,14 +305,31 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Unsupported file format!")
         return
     
-    # Download the file
-    file = await document.get_file()
-    file_path = f"temp_files/{user_id}_{document.file_id}{file_ext}"
-    await file.download_to_drive(file_path)
+    if document.file_size and document.file_size > MAX_DOWNLOAD_SIZE:
+        await update.message.reply_text(f"❌ File too large! Maximum size is {MAX_DOWNLOAD_SIZE // (1024 * 1024)}MB.")
+        return
+    
+    # Download the file (shared with anyone who sent the same media)
+    ref = input_ref(document, file_ext)
+    await input_store.fetch(ref['file_unique_id'], ref['ext'], telegram_download(context.bot, ref))
+    
+    if (file_type == 'audio'
+            and user_manager.get_user_state(user_id) == "awaiting_audio_merge"
+            and user_manager.session(user_id).file_type == 'video'):
+        # Keep the video as the current file; the audio only feeds the merge
+        user_manager.update(user_id, merge_audio=ref)
+        await update.message.reply_text(
+            "🎵 Audio received! How should different lengths be handled?",
+            reply_markup=InlineKeyboardMarkup(AV_MERGE_MENU)
+        )
+        return
     
     # Store file info
-    context.user_data['current_file'] = file_path
-    context.user_data['file_type'] = file_type
+    user_manager.update(user_id, current_file=ref, file_type=file_type)
+    
+    if file_type == 'video' and user_manager.get_user_state(user_id) == "awaiting_merge_files":
+        await add_merge_file(update, ref)
+        return
     
     keyboard = InlineKeyboardMarkup(MAIN_MENU)
     await update.message.reply_text(
@@ -147,6 +357,26 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         keyboard = InlineKeyboardMarkup(AUDIO_FORMATS)
         await query.edit_message_text("Select audio format:", reply_markup=keyboard)
     
+    elif data == "batch_menu":
+        user_manager.update(query.from_user.id, batch_formats=[])
+        await query.edit_message_text(
+            "Select every format you want (video and audio):",
+            reply_markup=batch_keyboard([])
+        )
+    
+    elif data == "batch_run":
+        await process_batch_conversion(query, context)
+    
+    elif data.startswith("batch_"):
+        choice = data.replace("batch_", "", 1)
+        selected = list(user_manager.session(query.from_user.id).batch_formats)
+        if choice in selected:
+            selected.remove(choice)
+        else:
+            selected.append(choice)
+        user_manager.update(query.from_user.id, batch_formats=selected)
+        await query.edit_message_reply_markup(reply_markup=batch_keyboard(selected))
+    
     elif data.startswith("format_"):
         format_type = data.replace("format_", "")
         await process_conversion(query, context, format_type)
@@ -158,9 +388,19 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif data == "merge_menu":
         await start_merge_process(query, context)
     
+    elif data == "add_more_merge":
+        await query.edit_message_text("📁 Send the next video file to add to the merge.")
+    
+    elif data == "process_merge":
+        await process_merge(query, context)
+    
     elif data == "av_merge_menu":
         await start_av_merge_process(query, context)
     
+    elif data.startswith("avmerge_"):
+        duration_mode = data.replace("avmerge_", "")
+        await process_av_merge(query, context, duration_mode)
+    
     elif data == "split_menu":
         await start_split_process(query, context)
     
@@ -170,103 +410,183 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def process_conversion(query, context, output_format):
     """Process video conversion"""
     user_id = query.from_user.id
+    session = user_manager.session(user_id)
     
-    if 'current_file' not in context.user_data:
+    if session.current_file is None:
         await query.edit_message_text("❌ Please send a video file first!")
         return
     
+    cache_key = result_cache.make_key(
+        session.current_file['file_unique_id'], 'convert', {'format': output_format}
+    )
+    if await send_cached_result(context.bot, query.message.chat_id, cache_key, "✅ Conversion completed!"):
+        await query.edit_message_text("⚡ Sent a cached conversion!")
+        return
+    
     await query.edit_message_text("🔄 Starting conversion...")
     
-    # Progress callback
-    async def progress_callback(progress, status):
-        try:
-            await context.bot.edit_message_text(
-                chat_id=query.message.chat_id,
-                message_id=query.message.message_id,
-                text=f"🔄 Converting... {progress}%\n{status}"
-            )
-        except:
-            pass
+    progress_callback = ProgressReporter(
+        context.bot, query.message.chat_id, query.message.message_id, user_id, "🔄 Converting..."
+    )
     
     try:
-        output_path = await VideoProcessor.convert_video(
-            context.user_data['current_file'],
-            output_format,
-            progress_callback
-        )
+        async with track_job('convert'), workspace_manager.job() as workdir:
+            async with use_input(context.bot, session.current_file) as input_path:
+                output_path, profile = await run_job(
+                    user_id, 'convert', [input_path], progress_callback,
+                    'convert_video', input_path, output_format, workdir
+                )
+            await progress_callback.finish()
         
-        # Send the converted file
-        with open(output_path, 'rb') as file:
-            await context.bot.send_document(
-                chat_id=query.message.chat_id,
-                document=InputFile(file, filename=f"converted.{output_format}"),
-                caption="✅ Conversion completed!"
+            # Send the converted file
+            await send_result(
+                context.bot, query.message.chat_id, 'document', output_path,
+                profile_caption("✅ Conversion completed!", profile),
+                filename=f"converted.{output_format}", cache_key=cache_key
             )
         
-        # Clean up
-        os.unlink(output_path)
-        
+    except JobRejected as e:
+        await progress_callback.close()
+        await query.edit_message_text(f"❌ {e}")
+    
     except Exception as e:
+        await progress_callback.close()
         logger.error(f"Conversion error: {e}")
         await query.edit_message_text("❌ Error during conversion!")
 
 async def process_audio_extraction(query, context, audio_format):
     """Extract audio from video"""
     user_id = query.from_user.id
+    session = user_manager.session(user_id)
     
-    if 'current_file' not in context.user_data:
-        await query.edit_message_text("❌ Please send a video file first!")
+    if session.current_file is None:
+        await query.edit_message_text("❌ Please send a video or audio file first!")
+        return
+    
+    cache_key = result_cache.make_key(
+        session.current_file['file_unique_id'], 'audio', {'format': audio_format}
+    )
+    if await send_cached_result(context.bot, query.message.chat_id, cache_key, "✅ Audio extraction completed!"):
+        await query.edit_message_text("⚡ Sent cached audio!")
         return
     
     await query.edit_message_text("🔄 Extracting audio...")
     
-    async def progress_callback(progress, status):
-        try:
-            await context.bot.edit_message_text(
-                chat_id=query.message.chat_id,
-                message_id=query.message.message_id,
-                text=f"🔄 Extracting audio... {progress}%\n{status}"
-            )
-        except:
-            pass
+    progress_callback = ProgressReporter(
+        context.bot, query.message.chat_id, query.message.message_id, user_id, "🔄 Extracting audio..."
+    )
     
     try:
-        output_path = await VideoProcessor.video_to_audio(
-            context.user_data['current_file'],
-            audio_format,
-            progress_callback
-        )
+        async with track_job('audio'), workspace_manager.job() as workdir:
+            async with use_input(context.bot, session.current_file) as input_path:
+                output_path, _ = await run_job(
+                    user_id, 'audio', [input_path], progress_callback,
+                    'video_to_audio', input_path, audio_format, workdir
+                )
+            await progress_callback.finish()
         
-        with open(output_path, 'rb') as file:
-            await context.bot.send_audio(
-                chat_id=query.message.chat_id,
-                audio=InputFile(file, filename=f"audio.{audio_format}"),
-                caption="✅ Audio extraction completed!"
+            await send_result(
+                context.bot, query.message.chat_id, 'audio', output_path,
+                "✅ Audio extraction completed!", filename=f"audio.{audio_format}", cache_key=cache_key
             )
         
-        os.unlink(output_path)
-        
+    except JobRejected as e:
+        await progress_callback.close()
+        await query.edit_message_text(f"❌ {e}")
+    
     except Exception as e:
+        await progress_callback.close()
         logger.error(f"Audio extraction error: {e}")
         await query.edit_message_text("❌ Error during audio extraction!")
 
+async def process_batch_conversion(query, context):
+    """Convert the current file to every selected format in one pass"""
+    user_id = query.from_user.id
+    session = user_manager.session(user_id)
+    selected = session.batch_formats
+    
+    if session.current_file is None:
+        await query.edit_message_text("❌ Please send a video file first!")
+        return
+    if not selected:
+        await query.edit_message_text("❌ Select at least one format!", reply_markup=batch_keyboard(selected))
+        return
+    
+    # Anything already converted before goes straight from the cache
+    file_unique_id = session.current_file['file_unique_id']
+    video_formats, audio_formats = [], []
+    for choice in selected:
+        kind, fmt = choice.split("_", 1)
+        if kind == "format":
+            cache_key = result_cache.make_key(file_unique_id, 'convert', {'format': fmt})
+            if not await send_cached_result(context.bot, query.message.chat_id, cache_key, "✅ Conversion completed!"):
+                video_formats.append(fmt)
+        else:
+            cache_key = result_cache.make_key(file_unique_id, 'audio', {'format': fmt})
+            if not await send_cached_result(context.bot, query.message.chat_id, cache_key, "✅ Audio extraction completed!"):
+                audio_formats.append(fmt)
+    
+    if not video_formats and not audio_formats:
+        await query.edit_message_text("⚡ Sent cached conversions!")
+        return
+    
+    await query.edit_message_text("🔄 Starting batch conversion...")
+    
+    progress_callback = ProgressReporter(
+        context.bot, query.message.chat_id, query.message.message_id, user_id, "🔄 Converting..."
+    )
+    
+    try:
+        async with track_job('batch'), workspace_manager.job() as workdir:
+            async with use_input(context.bot, session.current_file) as input_path:
+                outputs, profile = await run_job(
+                    user_id, 'batch', [input_path], progress_callback,
+                    'batch_convert', input_path, video_formats, audio_formats, workdir
+                )
+            await progress_callback.finish()
+        
+            # Upload every format at once rather than one after another
+            uploads = [
+                send_result(
+                    context.bot, query.message.chat_id, 'document', output_path,
+                    profile_caption("✅ Conversion completed!", profile), filename=f"converted.{fmt}",
+                    cache_key=result_cache.make_key(file_unique_id, 'convert', {'format': fmt})
+                )
+                for fmt, output_path in outputs['video'].items()
+            ]
+            uploads += [
+                send_result(
+                    context.bot, query.message.chat_id, 'audio', output_path, "✅ Audio extraction completed!",
+                    filename=f"audio.{fmt}",
+                    cache_key=result_cache.make_key(file_unique_id, 'audio', {'format': fmt})
+                )
+                for fmt, output_path in outputs['audio'].items()
+            ]
+            await asyncio.gather(*uploads)
+        
+    except JobRejected as e:
+        await progress_callback.close()
+        await query.edit_message_text(f"❌ {e}")
+    
+    except Exception as e:
+        await progress_callback.close()
+        logger.error(f"Batch conversion error: {e}")
+        await query.edit_message_text("❌ Error during batch conversion!")
+
 async def start_merge_process(query, context):
     """Start video merge process"""
     user_manager.set_user_state(query.from_user.id, "awaiting_merge_files")
     user_manager.clear_queue(query.from_user.id)
     
     # Add current file to queue if exists
-    if 'current_file' in context.user_data:
+    session = user_manager.session(query.from_user.id)
+    if session.current_file is not None:
         user_manager.add_to_queue(query.from_user.id, {
-            'path': context.user_data['current_file'],
-            'type': context.user_data['file_type']
+            'input': session.current_file,
+            'type': session.file_type
         })
     
-    keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("➕ Add More", callback_data="add_more_merge")],
-        [InlineKeyboardButton("🚀 Process Merge", callback_data="process_merge")],
-        [InlineKeyboardButton("🔙 Back", callback_data="main_menu")]
-    ])
+    keyboard = InlineKeyboardMarkup(MERGE_MENU)
     
     queue_count = len(user_manager.get_queue(query.from_user.id))
     await query.edit_message_text(
@@ -275,6 +595,74 @@ async def start_merge_process(query, context):
         reply_markup=keyboard
     )
 
+async def add_merge_file(update, ref):
+    """Queue a received video for the pending merge"""
+    user_id = update.message.from_user.id
+    user_manager.add_to_queue(user_id, {'input': ref, 'type': 'video'})
+    
+    queue_count = len(user_manager.get_queue(user_id))
+    await update.message.reply_text(
+        f"📁 Added to merge queue\nFiles in queue: {queue_count}",
+        reply_markup=InlineKeyboardMarkup(MERGE_MENU)
+    )
+
+async def process_merge(query, context):
+    """Merge all queued videos"""
+    user_id = query.from_user.id
+    tasks = [task for task in user_manager.get_queue(user_id) if task['type'] == 'video']
+    
+    if len(tasks) < 2:
+        await query.edit_message_text(
+            "❌ Send at least two videos to merge!",
+            reply_markup=InlineKeyboardMarkup(MERGE_MENU)
+        )
+        return
+    
+    unique_ids = [task['input']['file_unique_id'] for task in tasks]
+    cache_key = result_cache.make_key('+'.join(unique_ids), 'merge')
+    caption = f"✅ Merged {len(tasks)} videos!"
+    if await send_cached_result(context.bot, query.message.chat_id, cache_key, caption):
+        await query.edit_message_text("⚡ Sent a cached merge!")
+        user_manager.clear_queue(user_id)
+        user_manager.set_user_state(user_id, "idle")
+        return
+    
+    await query.edit_message_text("🔄 Merging videos...")
+    
+    progress_callback = ProgressReporter(
+        context.bot, query.message.chat_id, query.message.message_id, user_id, "🔄 Merging..."
+    )
+    
+    try:
+        async with track_job('merge'), workspace_manager.job() as workdir:
+            async with AsyncExitStack() as stack:
+                video_paths = [
+                    await stack.enter_async_context(use_input(context.bot, task['input']))
+                    for task in tasks
+                ]
+                output_path, profile = await run_job(
+                    user_id, 'merge', video_paths, progress_callback,
+                    'merge_videos', video_paths, workdir
+                )
+            await progress_callback.finish()
+        
+            await send_result(
+                context.bot, query.message.chat_id, 'video', output_path,
+                profile_caption(caption, profile), filename="merged.mp4", cache_key=cache_key
+            )
+        
+            user_manager.clear_queue(user_id)
+            user_manager.set_user_state(user_id, "idle")
+        
+    except JobRejected as e:
+        await progress_callback.close()
+        await query.edit_message_text(f"❌ {e}")
+    
+    except Exception as e:
+        await progress_callback.close()
+        logger.error(f"Merge error: {e}")
+        await query.edit_message_text("❌ Error during merge!")
+
 async def start_av_merge_process(query, context):
     """Start video-audio merge process"""
     await query.edit_message_text(
@@ -282,11 +670,64 @@ async def start_av_merge_process(query, context):
     )
     user_manager.set_user_state(query.from_user.id, "awaiting_audio_merge")
 
+async def process_av_merge(query, context, duration_mode):
+    """Replace the current video's soundtrack with the received audio"""
+    user_id = query.from_user.id
+    session = user_manager.session(user_id)
+    
+    if session.current_file is None or session.merge_audio is None:
+        await query.edit_message_text("❌ Please send a video and an audio file first!")
+        return
+    
+    cache_key = result_cache.make_key(
+        session.current_file['file_unique_id'], 'av_merge',
+        {'audio': session.merge_audio['file_unique_id'], 'duration_mode': duration_mode}
+    )
+    if await send_cached_result(context.bot, query.message.chat_id, cache_key, "✅ Video and audio merged!"):
+        await query.edit_message_text("⚡ Sent a cached merge!")
+        user_manager.set_user_state(user_id, "idle")
+        return
+    
+    await query.edit_message_text("🔄 Merging video and audio...")
+    
+    progress_callback = ProgressReporter(
+        context.bot, query.message.chat_id, query.message.message_id, user_id, "🔄 Merging..."
+    )
+    
+    try:
+        async with track_job('av_merge'), workspace_manager.job() as workdir:
+            async with use_input(context.bot, session.current_file) as video_path, \
+                    use_input(context.bot, session.merge_audio) as audio_path:
+                output_path, profile = await run_job(
+                    user_id, 'av_merge', [video_path], progress_callback,
+                    'merge_video_audio', video_path, audio_path, workdir, duration_mode
+                )
+            await progress_callback.finish()
+        
+            await send_result(
+                context.bot, query.message.chat_id, 'video', output_path,
+                profile_caption("✅ Video and audio merged!", profile),
+                filename=os.path.basename(output_path), cache_key=cache_key
+            )
+        
+            user_manager.set_user_state(user_id, "idle")
+        
+    except JobRejected as e:
+        await progress_callback.close()
+        await query.edit_message_text(f"❌ {e}")
+    
+    except Exception as e:
+        await progress_callback.close()
+        logger.error(f"Audio merge error: {e}")
+        await query.edit_message_text("❌ Error during video and audio merge!")
+
 async def start_split_process(query, context):
     """Start video split process"""
     await query.edit_message_text(
         "Please send the start and end times in format: start_seconds end_seconds\n"
-        "Example: `10 30` - to split from 10s to 30s"
+        "Example: `10 30` - to split from 10s to 30s\n\n"
+        "Several clips at once: `10 30, 45 60, 90 120`\n"
+        "Equal parts: `every 60` - a clip for every 60s"
     )
     user_manager.set_user_state(query.from_user.id, "awaiting_split_times")
 
@@ -306,97 +747,234 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if state == "awaiting_split_times":
         try:
-            start_time, end_time = map(float, text.split())
-            await process_video_split(update, context, start_time, end_time)
-        except:
-            await update.message.reply_text("❌ Invalid format! Use: start_seconds end_seconds")
+            ranges, segment_length = parse_split_request(text)
+        except ValueError:
+            await update.message.reply_text(
+                "❌ Invalid format! Use: start_seconds end_seconds, "
+                f"up to {MAX_SPLIT_CLIPS} ranges separated by commas, or: every seconds"
+            )
+        else:
+            if ranges is not None and len(ranges) == 1:
+                await process_video_split(update, context, *ranges[0])
+            else:
+                await process_multi_split(update, context, ranges, segment_length)
     
     elif state == "awaiting_new_name":
         await process_rename(update, context, text)
     
     user_manager.set_user_state(user_id, "idle")
 
+def _parse_seconds(value):
+    seconds = float(value)
+    # float() also takes "nan" and "inf"
+    if not math.isfinite(seconds):
+        raise ValueError(value)
+    return seconds
+
+def parse_split_request(text):
+    """Parse `start end` ranges separated by commas/newlines, or `every N`
+
+    Returns (ranges, None) or (None, segment_length); raises ValueError.
+    """
+    text = text.strip().lower()
+    if text.startswith("every"):
+        words = text.split()
+        if len(words) != 2:
+            raise ValueError(text)
+        segment_length = _parse_seconds(words[1].rstrip("s"))
+        if segment_length <= 0:
+            raise ValueError(text)
+        return None, segment_length
+    
+    ranges = []
+    for part in re.split(r"[,;\n]+", text):
+        if not part.strip():
+            continue
+        words = part.split()
+        if len(words) == 3 and words[1] == "-":
+            words = [words[0], words[2]]
+        elif len(words) == 1:
+            # "5-10": a dash only separates when it sits between two numbers
+            match = re.fullmatch(r"(\d+(?:\.\d*)?)-(\d+(?:\.\d*)?)", words[0])
+            if match is None:
+                raise ValueError(part)
+            words = list(match.groups())
+        if len(words) != 2:
+            raise ValueError(part)
+        start_time, end_time = map(_parse_seconds, words)
+        if start_time < 0 or end_time <= start_time:
+            raise ValueError(part)
+        ranges.append((start_time, end_time))
+    if not ranges or len(ranges) > MAX_SPLIT_CLIPS:
+        raise ValueError(text)
+    return ranges, None
+
+async def process_multi_split(update, context, ranges, segment_length):
+    """Cut several clips from one pass over the video and send them together"""
+    user_id = update.message.from_user.id
+    session = user_manager.session(user_id)
+    
+    if session.current_file is None:
+        await update.message.reply_text("❌ Please send a video file first!")
+        return
+    
+    message = await update.message.reply_text("🔄 Splitting video...")
+    
+    progress_callback = ProgressReporter(
+        context.bot, message.chat_id, message.message_id, user_id, "🔄 Splitting..."
+    )
+    
+    try:
+        async with track_job('split'), workspace_manager.job() as workdir:
+            async with use_input(context.bot, session.current_file) as input_path:
+                if ranges is not None:
+                    caption = f"✅ {len(ranges)} clips cut!"
+                    job = ('split_video_ranges', input_path, ranges, workdir)
+                else:
+                    info = await asyncio.to_thread(probe_media, input_path)
+                    if info['duration'] / segment_length > MAX_SPLIT_CLIPS:
+                        raise JobRejected(f"That would make more than {MAX_SPLIT_CLIPS} clips. Use a longer length.")
+                    caption = f"✅ Video split into {segment_length:g}s clips!"
+                    job = ('split_video_segments', input_path, segment_length, workdir)
+                clip_paths, profile = await run_job(user_id, 'split', [input_path], progress_callback, *job)
+            await progress_callback.finish()
+        
+            await send_clips(context.bot, update.message.chat_id, clip_paths, profile_caption(caption, profile))
+            await message.delete()
+        
+    except JobRejected as e:
+        await progress_callback.close()
+        await message.edit_text(f"❌ {e}")
+    
+    except Exception as e:
+        await progress_callback.close()
+        logger.error(f"Split error: {e}")
+        await message.edit_text("❌ Error during video split!")
+
 async def process_video_split(update, context, start_time, end_time):
     """Process video splitting"""
+    session = user_manager.session(update.message.from_user.id)
+    
+    if session.current_file is None:
+        await update.message.reply_text("❌ Please send a video file first!")
+        return
+    
+    caption = f"✅ Video split from {start_time}s to {end_time}s!"
+    cache_key = result_cache.make_key(
+        session.current_file['file_unique_id'], 'split', {'start': start_time, 'end': end_time}
+    )
+    if await send_cached_result(context.bot, update.message.chat_id, cache_key, caption):
+        return
+    
     message = await update.message.reply_text("🔄 Splitting video...")
     
-    async def progress_callback(progress, status):
-        try:
-            await context.bot.edit_message_text(
-                chat_id=message.chat_id,
-                message_id=message.message_id,
-                text=f"🔄 Splitting... {progress}%\n{status}"
-            )
-        except:
-            pass
+    progress_callback = ProgressReporter(
+        context.bot, message.chat_id, message.message_id, update.message.from_user.id, "🔄 Splitting..."
+    )
     
     try:
-        output_path = await VideoProcessor.split_video(
-            context.user_data['current_file'],
-            start_time,
-            end_time,
-            progress_callback
-        )
+        async with track_job('split'), workspace_manager.job() as workdir:
+            async with use_input(context.bot, session.current_file) as input_path:
+                output_path, profile = await run_job(
+                    update.message.from_user.id, 'split', [input_path], progress_callback,
+                    'split_video', input_path, start_time, end_time, workdir
+                )
+            await progress_callback.finish()
         
-        with open(output_path, 'rb') as file:
-            await context.bot.send_video(
-                chat_id=update.message.chat_id,
-                video=InputFile(file),
-                caption=f"✅ Video split from {start_time}s to {end_time}s!"
+            await send_result(
+                context.bot, update.message.chat_id, 'video', output_path,
+                profile_caption(caption, profile), cache_key=cache_key
             )
         
-        os.unlink(output_path)
-        await message.delete()
+            await message.delete()
         
+    except JobRejected as e:
+        await progress_callback.close()
+        await message.edit_text(f"❌ {e}")
+    
     except Exception as e:
+        await progress_callback.close()
         logger.error(f"Split error: {e}")
         await message.edit_text("❌ Error during video split!")
 
 async def process_rename(update, context, new_name):
     """Process file renaming"""
+    session = user_manager.session(update.message.from_user.id)
+    
+    if session.current_file is None:
+        await update.message.reply_text("❌ Please send a file first!")
+        return
+    
+    cache_key = result_cache.make_key(
+        session.current_file['file_unique_id'], 'rename', {'name': new_name}
+    )
+    if await send_cached_result(context.bot, update.message.chat_id, cache_key, "✅ File renamed!"):
+        return
+    
     try:
-        output_path = await VideoProcessor.rename_file(
-            context.user_data['current_file'],
-            new_name
-        )
+        async with track_job('rename'), workspace_manager.job() as workdir:
+            async with use_input(context.bot, session.current_file) as input_path:
+                output_path = await VideoProcessor.rename_file(input_path, new_name, workdir)
         
-        file_type = context.user_data['file_type']
-        
-        if file_type == 'video':
-            with open(output_path, 'rb') as file:
-                await context.bot.send_video(
-                    chat_id=update.message.chat_id,
-                    video=InputFile(file, filename=new_name),
-                    caption="✅ File renamed!"
-                )
-        else:
-            with open(output_path, 'rb') as file:
-                await context.bot.send_document(
-                    chat_id=update.message.chat_id,
-                    document=InputFile(file, filename=new_name),
-                    caption="✅ File renamed!"
-                )
-        
-        os.unlink(output_path)
+            kind = 'video' if session.file_type == 'video' else 'document'
+            await send_result(
+                context.bot, update.message.chat_id, kind, output_path,
+                "✅ File renamed!", filename=new_name, cache_key=cache_key
+            )
         
     except Exception as e:
         logger.error(f"Rename error: {e}")
         await update.message.reply_text("❌ Error during renaming!")
 
+async def startup(application: Application):
+    """Reclaim temp files from a previous run and start background upkeep"""
+    workspace_manager.start()
+    input_store.start()
+    user_manager.start()
+    job_runner.start()
+    await metrics.start()
+
+async def shutdown(application: Application):
+    """Save sessions and stop the encoding workers"""
+    await metrics.stop()
+    user_manager.stop()
+    workspace_manager.stop()
+    job_executor.shutdown(wait=False)
+
 def main():
     """Start the bot"""
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Handlers only await pool jobs, so updates can be processed concurrently
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(True)
+        .post_init(startup)
+        .post_shutdown(shutdown)
+    )
+    if LOCAL_BOT_API_URL:
+        # Lifts the 20MB download / 50MB upload limits and skips the HTTP file transfers
+        builder = (
+            builder
+            .base_url(f"{LOCAL_BOT_API_URL}/bot")
+            .base_file_url(f"{LOCAL_BOT_API_URL}/file/bot")
+            .local_mode(True)
+        )
+    application = builder.build()
     
     # Add handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(MessageHandler(filters.VIDEO, handle_video))
-    application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
-    application.add_handler(CallbackQueryHandler(button_handler))
+    application.add_handler(CommandHandler("start", instrument(start)))
+    application.add_handler(MessageHandler(filters.VIDEO, instrument(handle_video)))
+    application.add_handler(MessageHandler(filters.Document.ALL, instrument(handle_document)))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, instrument(handle_text)))
+    application.add_handler(CallbackQueryHandler(instrument(button_handler)))
     
     # Start bot
     print("Bot is running...")
-    application.run_polling()
+    if BOT_MODE == "webhook":
+        run_webhook(application)
+    else:
+        application.run_polling()
 
 if __name__ == "__main__":
+    # Works, but pool workers then re-import this module; prefer main.py
     main()
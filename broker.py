@@ -0,0 +1,190 @@
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+from typing import Awaitable, Callable, Dict, Optional
+from config import BROKER_PATH, BROKER_POLL_INTERVAL, WORKER_HEARTBEAT_TIMEOUT, MAX_JOB_ATTEMPTS
+
+class JobFailed(Exception):
+    """A worker gave up on the job; the message is the worker's error"""
+
+class Broker:
+    """Durable job queue in SQLite, shared by the bot and worker processes
+
+    The bot enqueues serialized jobs and polls them for progress and the
+    result. Workers claim queued jobs one at a time, heartbeat while running
+    them and post the outcome. Jobs whose worker stops heartbeating are put
+    back in the queue up to MAX_JOB_ATTEMPTS times.
+
+    All processes must be on one host: WAL mode needs a local filesystem.
+    """
+    def __init__(self, path: str = BROKER_PATH, poll_interval: float = BROKER_POLL_INTERVAL,
+                 heartbeat_timeout: float = WORKER_HEARTBEAT_TIMEOUT, max_attempts: int = MAX_JOB_ATTEMPTS):
+        self.poll_interval = poll_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_attempts = max_attempts
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " method TEXT NOT NULL,"
+            " args TEXT NOT NULL,"
+            " reply TEXT NOT NULL,"
+            " profile TEXT,"
+            " status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " worker TEXT,"
+            " progress INTEGER,"
+            " status_text TEXT,"
+            " result TEXT,"
+            " error TEXT,"
+            " created REAL NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        if 'profile' not in columns:
+            # Queue files created before encoding profiles
+            self._db.execute("ALTER TABLE jobs ADD COLUMN profile TEXT")
+
+    # Bot side
+
+    def enqueue(self, method: str, args: list, reply: dict = None, profile: Optional[str] = None) -> str:
+        """Queue VideoProcessor.<method>(*args); reply says who the result is for"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._db.execute(
+            "INSERT INTO jobs (id, method, args, reply, profile, status, created, updated)"
+            " VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+            (job_id, method, json.dumps(args), json.dumps(reply or {}), profile, now, now)
+        )
+        return job_id
+
+    async def wait(self, job_id: str, on_progress: Optional[Callable[[float, str], Awaitable]] = None):
+        """Relay progress until the job finishes, then return its result
+
+        Every query runs in a thread: a worker holding the write lock can
+        keep one waiting for up to the 30s busy timeout, and the event loop
+        must keep serving other chats meanwhile.
+        """
+        shown = None
+        try:
+            while True:
+                row = await asyncio.to_thread(self._state, job_id)
+                if row is None:
+                    raise JobFailed("Job disappeared from the queue")
+                status, progress, status_text, result, error = row
+                if status == 'done':
+                    return json.loads(result)
+                if status in ('failed', 'cancelled'):
+                    raise JobFailed(error or status)
+                if on_progress is not None and progress is not None and (progress, status_text) != shown:
+                    shown = (progress, status_text)
+                    await on_progress(progress, status_text)
+                await asyncio.sleep(self.poll_interval)
+        except asyncio.CancelledError:
+            await asyncio.to_thread(self.cancel, job_id)
+            raise
+        finally:
+            # Finished or abandoned, nobody will read this row again
+            await asyncio.to_thread(self._forget, job_id)
+
+    def _state(self, job_id: str):
+        return self._db.execute(
+            "SELECT status, progress, status_text, result, error FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+
+    def _forget(self, job_id: str):
+        self._db.execute("DELETE FROM jobs WHERE id = ? AND status != 'running'", (job_id,))
+
+    def cancel(self, job_id: str):
+        self._db.execute(
+            "UPDATE jobs SET status = 'cancelled', updated = ? WHERE id = ? AND status IN ('queued', 'running')",
+            (time.time(), job_id)
+        )
+
+    def cancel_pending(self):
+        """Drop every unfinished job; their waiters died with the previous bot process"""
+        self._db.execute(
+            "UPDATE jobs SET status = 'cancelled', updated = ? WHERE status IN ('queued', 'running')",
+            (time.time(),)
+        )
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    # Worker side
+
+    def claim(self, worker: str) -> Optional[dict]:
+        """Take the oldest queued job, or None if there is nothing to do"""
+        now = time.time()
+        self._recover(now)
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._db.execute(
+                "SELECT id, method, args, reply, profile FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                self._db.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, updated = ?"
+                    " WHERE id = ?",
+                    (worker, now, row[0])
+                )
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return {
+            'id': row[0], 'method': row[1], 'args': json.loads(row[2]), 'reply': json.loads(row[3]),
+            'profile': row[4],
+        }
+
+    def _recover(self, now: float):
+        # Jobs of workers that stopped heartbeating: retry, or give up
+        stale = now - self.heartbeat_timeout
+        self._db.execute(
+            "UPDATE jobs SET status = 'failed', error = 'Worker lost', updated = ?"
+            " WHERE status = 'running' AND updated < ? AND attempts >= ?",
+            (now, stale, self.max_attempts)
+        )
+        self._db.execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL, updated = ?"
+            " WHERE status = 'running' AND updated < ?",
+            (now, stale)
+        )
+        # Outcomes nobody collected within an hour
+        self._db.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND updated < ?",
+            (now - 3600,)
+        )
+
+    def heartbeat(self, job_id: str, worker: str, progress: float = None, status_text: str = None) -> bool:
+        """Mark the job alive (with optional progress); False once it was cancelled or taken over"""
+        if progress is None:
+            cursor = self._db.execute(
+                "UPDATE jobs SET updated = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time(), job_id, worker)
+            )
+        else:
+            cursor = self._db.execute(
+                "UPDATE jobs SET updated = ?, progress = ?, status_text = ?"
+                " WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time(), progress, status_text, job_id, worker)
+            )
+        return cursor.rowcount > 0
+
+    def complete(self, job_id: str, worker: str, result):
+        self._db.execute(
+            "UPDATE jobs SET status = 'done', result = ?, updated = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (json.dumps(result), time.time(), job_id, worker)
+        )
+
+    def fail(self, job_id: str, worker: str, error: str):
+        self._db.execute(
+            "UPDATE jobs SET status = 'failed', error = ?, updated = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (error, time.time(), job_id, worker)
+        )
@@ -6,8 +6,114 @@ load_dotenv()
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 MAX_FILE_SIZE = 500 * 1024 * 1024  # 500MB
 TEMP_DIR = "temp_files"
+DATA_DIR = os.getenv('DATA_DIR', "data")
+
+# How updates arrive: 'polling', or 'webhook' to serve HTTP on PORT
+BOT_MODE = os.getenv('BOT_MODE', "polling")
+PORT = int(os.getenv('PORT', 8080))
+# Public base URL to register with Telegram, e.g. https://my-app.koyeb.app
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', "/telegram")
+# Random per start when unset
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))
+
+# Prometheus metrics on http://METRICS_HOST:METRICS_PORT/metrics (0 turns it off)
+METRICS_HOST = os.getenv('METRICS_HOST', "127.0.0.1")
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9090))
+# Write a Chrome trace of every job's phases here when set
+METRICS_TRACE_DIR = os.getenv('METRICS_TRACE_DIR')
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', 0.5))  # seconds
+
+# Self-hosted Bot API server (telegram-bot-api --local), e.g. http://localhost:8081.
+# It and this process must see the same paths (a shared volume): received
+# files are read in place and results are sent as file:// references.
+LOCAL_BOT_API_URL = os.getenv('LOCAL_BOT_API_URL')
+# The public Bot API only serves downloads up to 20MB
+MAX_DOWNLOAD_SIZE = MAX_FILE_SIZE if LOCAL_BOT_API_URL else min(MAX_FILE_SIZE, 20 * 1024 * 1024)
+
 SUPPORTED_VIDEO_FORMATS = ['.mp4', '.avi', '.mov', '.mkv', '.wmv']
 SUPPORTED_AUDIO_FORMATS = ['.mp3', '.wav', '.aac', '.m4a']
 
-# Create temp directory if not exists
+# Encoding worker pool
+MAX_WORKERS = int(os.getenv('MAX_WORKERS', os.cpu_count() or 1))
+MAX_CONCURRENT_JOBS = int(os.getenv('MAX_CONCURRENT_JOBS', MAX_WORKERS))
+
+# Transcodes at least this long are split at keyframes and encoded in parallel
+CHUNKED_MIN_DURATION = float(os.getenv('CHUNKED_MIN_DURATION', 120))  # seconds
+CHUNK_MIN_SECONDS = float(os.getenv('CHUNK_MIN_SECONDS', 20))
+
+# MP4/MOV results get their index moved up front (+faststart), which every
+# player handles. Set to true to write fragmented MP4 instead: finished in
+# one pass without that rewrite, but some players seek it poorly.
+FRAGMENTED_MP4 = os.getenv('FRAGMENTED_MP4', 'false').lower() == 'true'
+
+# Library for the full re-encode each operation falls back to when streams
+# can't just be copied: 'moviepy', 'ffmpeg', or 'pydub' (audio only). Each
+# is imported only once a job in that process actually needs it.
+BACKENDS = {
+    'convert': os.getenv('CONVERT_BACKEND', "moviepy"),
+    'merge': os.getenv('MERGE_BACKEND', "moviepy"),
+    'split': os.getenv('SPLIT_BACKEND', "moviepy"),
+    'av_merge': os.getenv('AV_MERGE_BACKEND', "moviepy"),
+    'audio': os.getenv('AUDIO_BACKEND', "ffmpeg"),
+}
+
+# Most clips one split request may produce (more than 10 are sent as a zip)
+MAX_SPLIT_CLIPS = int(os.getenv('MAX_SPLIT_CLIPS', 50))
+
+# Where jobs run: 'local' (this process's pool) or 'broker' (worker.py
+# processes on this host pulling from a SQLite queue). With 'broker', set
+# MAX_CONCURRENT_JOBS to the total WORKER_JOBS of all workers. BROKER_PATH
+# must be on a local disk: SQLite's WAL mode doesn't work over NFS/SMB.
+JOB_BACKEND = os.getenv('JOB_BACKEND', "local")
+BROKER_PATH = os.path.join(DATA_DIR, "broker.sqlite3")
+BROKER_POLL_INTERVAL = float(os.getenv('BROKER_POLL_INTERVAL', 0.5))  # seconds
+WORKER_JOBS = int(os.getenv('WORKER_JOBS', 2))  # jobs one worker.py runs at once
+WORKER_HEARTBEAT_TIMEOUT = float(os.getenv('WORKER_HEARTBEAT_TIMEOUT', 60))  # seconds
+MAX_JOB_ATTEMPTS = int(os.getenv('MAX_JOB_ATTEMPTS', 2))
+
+# Fair scheduling and admission control. Job cost is measured in
+# megapixel-seconds of input weighted by operation (see scheduler.py).
+MAX_JOBS_PER_USER = int(os.getenv('MAX_JOBS_PER_USER', 1))
+MAX_QUEUED_JOBS_PER_USER = int(os.getenv('MAX_QUEUED_JOBS_PER_USER', 5))
+MAX_JOB_COST = float(os.getenv('MAX_JOB_COST', 20000))  # ~2.5h of 1080p
+HEAVY_JOB_COST = float(os.getenv('HEAVY_JOB_COST', 2000))
+MAX_HEAVY_JOBS = int(os.getenv('MAX_HEAVY_JOBS', max(1, MAX_CONCURRENT_JOBS // 2)))
+
+# Encoding profiles (profiles.py). ENCODING_PROFILE pins every job to one;
+# otherwise each job gets one from the queue depth and its input size.
+ENCODING_PROFILE = os.getenv('ENCODING_PROFILE')
+PROFILE_BUSY_QUEUE = int(os.getenv('PROFILE_BUSY_QUEUE', MAX_CONCURRENT_JOBS))  # waiting jobs
+PROFILE_SATURATED_QUEUE = int(os.getenv('PROFILE_SATURATED_QUEUE', 3 * MAX_CONCURRENT_JOBS))
+# Jobs up to this cost get the best profile while nothing is waiting
+PROFILE_QUALITY_MAX_COST = float(os.getenv('PROFILE_QUALITY_MAX_COST', 200))  # ~100s of 1080p
+
+# Seconds between progress message edits in one chat
+PROGRESS_EDIT_INTERVAL = float(os.getenv('PROGRESS_EDIT_INTERVAL', 3))
+
+# Downloaded inputs shared across users, evicted LRU beyond the byte budget
+INPUT_CACHE_DIR = os.path.join(TEMP_DIR, "inputs")
+INPUT_CACHE_BYTES = int(os.getenv('INPUT_CACHE_BYTES', 5 * 1024 * 1024 * 1024))  # 5GB
+
+# Per-job working directories and the janitor that enforces their quotas
+JOBS_DIR = os.path.join(TEMP_DIR, "jobs")
+WORKSPACE_MAX_AGE = float(os.getenv('WORKSPACE_MAX_AGE', 6 * 3600))  # seconds
+WORKSPACE_MAX_BYTES = int(os.getenv('WORKSPACE_MAX_BYTES', 10 * 1024 * 1024 * 1024))  # 10GB
+JANITOR_INTERVAL = float(os.getenv('JANITOR_INTERVAL', 300))  # seconds
+
+# Telegram file_ids of finished results, for answering repeat requests
+RESULT_CACHE_PATH = os.path.join(DATA_DIR, "result_cache.sqlite3")
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', 10000))
+RESULT_CACHE_TTL = float(os.getenv('RESULT_CACHE_TTL', 30 * 24 * 3600))  # seconds
+
+# Per-user sessions (menu state, current file, merge queue). A bounded number
+# stay in memory; all of them persist on disk until idle for SESSION_TTL.
+SESSION_DB_PATH = os.path.join(DATA_DIR, "sessions.sqlite3")
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', 10000))
+SESSION_TTL = float(os.getenv('SESSION_TTL', 30 * 24 * 3600))  # seconds
+SESSION_FLUSH_INTERVAL = float(os.getenv('SESSION_FLUSH_INTERVAL', 2))  # seconds
+
+# Create temp and data directories if not exists
 os.makedirs(TEMP_DIR, exist_ok=True)
+os.makedirs(DATA_DIR, exist_ok=True)
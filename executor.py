@@ -0,0 +1,214 @@
+import queue
+import asyncio
+import logging
+import functools
+import contextvars
+import multiprocessing
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, Deque, Dict, Optional
+from config import MAX_WORKERS, MAX_CONCURRENT_JOBS
+import progress as progress_sink
+import profiles
+
+logger = logging.getLogger(__name__)
+
+def _run_in_worker(progress_queue, stop, profile: str, fn: Callable, args: tuple, kwargs: dict):
+    # Runs in the worker: route progress.report() calls to this job's queue
+    # and encode with the profile the job was submitted under
+    progress_sink.set_sink(progress_queue, stop)
+    try:
+        with profiles.using(profile) as scope:
+            result = fn(*args, **kwargs)
+        return result, scope.applied
+    finally:
+        progress_sink.set_sink(None)
+
+def _next_report(progress_queue) -> Optional[Dict]:
+    try:
+        item = progress_queue.get(timeout=0.5)
+    except queue.Empty:
+        return None
+    # Only the newest report matters; drop the backlog
+    while True:
+        try:
+            item = progress_queue.get_nowait()
+        except queue.Empty:
+            return item
+
+class Job:
+    """Awaitable handle for a function running in the worker pool"""
+    def __init__(self, task: asyncio.Task):
+        self._task = task
+    
+    def __await__(self):
+        return self._task.__await__()
+    
+    def done(self) -> bool:
+        return self._task.done()
+    
+    def cancel(self) -> bool:
+        return self._task.cancel()
+    
+    def result(self):
+        return self._task.result()
+
+# The job that tasks submitted from this context belong to
+_current_job: contextvars.ContextVar = contextvars.ContextVar('executor_job', default=None)
+
+@contextmanager
+def job_scope():
+    """Tag pool tasks submitted inside the block as one job for fair sharing"""
+    token = _current_job.set(object())
+    try:
+        yield
+    finally:
+        _current_job.reset(token)
+
+class JobExecutor:
+    """Runs blocking media work in a process pool, off the bot's event loop
+
+    Up to max_concurrent tasks run at once. A job may fan out into many
+    tasks (chunks, normalized merge inputs), so a freed slot goes to the
+    waiting job with the fewest tasks running rather than first come, first
+    served: a job uses idle slots freely, but never holds more than its
+    share while another job waits.
+    """
+    def __init__(self, max_workers: int = MAX_WORKERS, max_concurrent: int = MAX_CONCURRENT_JOBS):
+        self.max_workers = max(1, max_workers)
+        self.max_concurrent = max(1, max_concurrent)
+        self.active_jobs = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._running: Dict[object, int] = {}
+        self._waiting: Dict[object, Deque[asyncio.Future]] = {}
+    
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn keeps workers clear of the bot's threads and sockets
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+    
+    def _get_manager(self):
+        if self._manager is None:
+            self._manager = multiprocessing.get_context("spawn").Manager()
+        return self._manager
+    
+    async def _acquire(self, job):
+        if self.active_jobs < self.max_concurrent and not self._waiting:
+            self._start(job)
+            return
+        slot = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(job, deque()).append(slot)
+        try:
+            await slot
+        except asyncio.CancelledError:
+            if slot.done() and not slot.cancelled():
+                # Granted just as we were cancelled; pass the slot on
+                self._release(job)
+            else:
+                self._forget(job, slot)
+            raise
+    
+    def _start(self, job):
+        self.active_jobs += 1
+        self._running[job] = self._running.get(job, 0) + 1
+    
+    def _forget(self, job, slot: asyncio.Future):
+        waiting = self._waiting.get(job)
+        if waiting is not None and slot in waiting:
+            waiting.remove(slot)
+            if not waiting:
+                del self._waiting[job]
+    
+    def _release(self, job):
+        self.active_jobs -= 1
+        self._running[job] -= 1
+        if not self._running[job]:
+            del self._running[job]
+        while self.active_jobs < self.max_concurrent and self._waiting:
+            nxt = min(self._waiting, key=lambda waiting_job: self._running.get(waiting_job, 0))
+            slot = self._waiting[nxt].popleft()
+            if not self._waiting[nxt]:
+                del self._waiting[nxt]
+            self._start(nxt)
+            slot.set_result(None)
+    
+    def submit(self, fn: Callable, *args,
+               progress: Optional[Callable[[Dict], Awaitable]] = None, **kwargs) -> Job:
+        """Schedule fn(*args, **kwargs) in the pool and return an awaitable handle
+        
+        If progress is given, it is awaited on the event loop with the newest
+        report the job published through progress.report(). fn encodes with
+        the caller's profiles.active() profile.
+        """
+        task = asyncio.get_running_loop().create_task(
+            self._run(fn, args, kwargs, progress, _current_job.get())
+        )
+        return Job(task)
+    
+    async def _run(self, fn: Callable, args: tuple, kwargs: dict, progress, job):
+        await self._acquire(job)
+        future = None
+        try:
+            loop = asyncio.get_running_loop()
+            progress_queue = stop = pump = None
+            if progress is not None:
+                manager = self._get_manager()
+                progress_queue, stop = manager.Queue(), manager.Event()
+                pump = loop.create_task(self._pump(progress_queue, progress))
+            try:
+                future = self._get_pool().submit(
+                    _run_in_worker, progress_queue, stop, profiles.active(), fn, args, kwargs
+                )
+                result, applied = await asyncio.wrap_future(future)
+            except asyncio.CancelledError:
+                if stop is not None:
+                    # ffmpeg and moviepy check this and stop encoding
+                    stop.set()
+                raise
+            finally:
+                if pump is not None:
+                    pump.cancel()
+            if applied:
+                profiles.mark_applied()
+            return result
+        finally:
+            if future is None or future.done():
+                self._release(job)
+            else:
+                # Cancelling the task doesn't stop the pool process, so the
+                # slot stays taken until the task there really ends
+                future.add_done_callback(functools.partial(self._release_from_pool, loop, job))
+    
+    def _release_from_pool(self, loop: asyncio.AbstractEventLoop, job, future):
+        try:
+            loop.call_soon_threadsafe(self._release, job)
+        except RuntimeError:
+            # Loop already closed: the bot is shutting down
+            pass
+    
+    async def _pump(self, progress_queue, progress: Callable[[Dict], Awaitable]):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await loop.run_in_executor(None, _next_report, progress_queue)
+            if item is not None:
+                try:
+                    await progress(item)
+                except Exception as e:
+                    # A failed progress update must not fail the encode
+                    logger.warning(f"Progress callback failed: {e}", exc_info=True)
+    
+    def shutdown(self, wait: bool = True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+
+job_executor = JobExecutor()
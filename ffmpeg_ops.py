@@ -0,0 +1,561 @@
+import os
+import subprocess
+import threading
+from typing import List, Optional
+import ffmpeg
+from config import FRAGMENTED_MP4
+import progress
+import profiles
+
+FFMPEG_BIN = 'ffmpeg'
+
+def run_ffmpeg(args: List[str]):
+    """Run ffmpeg with args, raising ffmpeg.Error on a non-zero exit
+
+    Encoder progress is streamed from `-progress pipe:1` to the current job's
+    progress sink while the command runs.
+    """
+    cmd = [FFMPEG_BIN, '-hide_banner', '-nostdin', '-y', '-progress', 'pipe:1', '-nostats'] + args
+    if progress.stopped():
+        raise ffmpeg.Error(FFMPEG_BIN, b'', b'Cancelled')
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    
+    # Drain stderr on the side so a chatty encoder can't fill the pipe and stall
+    stderr_chunks = []
+    reader = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()), daemon=True)
+    reader.start()
+    
+    state = {}
+    for raw in proc.stdout:
+        if progress.parse_ffmpeg_progress(raw.decode(errors='ignore'), state):
+            if progress.stopped():
+                # The job was cancelled; don't spend the slot on a result nobody wants
+                proc.kill()
+                break
+            progress.report(out_time=state.get('out_time'), speed=state.get('speed'))
+    
+    proc.wait()
+    reader.join()
+    if progress.stopped():
+        raise ffmpeg.Error(FFMPEG_BIN, b'', b'Cancelled')
+    if proc.returncode != 0:
+        raise ffmpeg.Error(FFMPEG_BIN, b'', b''.join(stderr_chunks))
+
+def _movflags(output_path: str) -> Optional[str]:
+    if output_path.lower().endswith(('.mp4', '.mov')) and FRAGMENTED_MP4:
+        # The index travels with each fragment, so the file is complete the
+        # moment the encoder stops; faststart would rewrite it all once more
+        return '+frag_keyframe+empty_moov+default_base_moof'
+    if output_path.lower().endswith(('.mp4', '.mov', '.m4a')):
+        return '+faststart'
+    return None
+
+def _container_flags(output_path: str) -> List[str]:
+    movflags = _movflags(output_path)
+    return ['-movflags', movflags] if movflags else []
+
+def remux(input_path: str, output_path: str):
+    """Copy all video and audio streams into a new container without re-encoding"""
+    run_ffmpeg([
+        '-i', input_path,
+        '-map', '0:V?', '-map', '0:a?',
+        '-c', 'copy',
+        *_container_flags(output_path),
+        output_path,
+    ])
+
+# Encoders able to produce segments that splice cleanly with copied GOPs
+SMART_CUT_ENCODERS = {
+    'h264': 'libx264',
+    'hevc': 'libx265',
+}
+
+# Minimum edge length worth its own segment (shorter gaps are below one frame)
+_EDGE_EPSILON = 0.001
+
+def _audio_encoder(output_path: str) -> str:
+    if output_path.lower().endswith('.avi'):
+        return 'libmp3lame'
+    return 'aac'
+
+def concat_copy(segment_paths: List[str], output_path: str, extra_args: List[str] = None):
+    """Join segments with the concat demuxer, copying every stream"""
+    list_path = f"{output_path}.concat.txt"
+    with open(list_path, 'w') as f:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    
+    try:
+        run_ffmpeg([
+            '-f', 'concat', '-safe', '0',
+            '-i', list_path,
+            '-map', '0:V?', '-map', '0:a?',
+            '-c', 'copy',
+            *(extra_args or []),
+            *_container_flags(output_path),
+            output_path,
+        ])
+    finally:
+        os.unlink(list_path)
+
+# Bitstream filters that repeat a stream's decoder config (SPS/PPS, VOL)
+# in-band at every keyframe
+IN_BAND_BSF = {
+    'h264': 'h264_mp4toannexb',
+    'hevc': 'hevc_mp4toannexb',
+    'mpeg4': 'dump_extra=freq=keyframe',
+}
+
+def concat_join(input_paths: List[str], output_path: str, video_codec: Optional[str]):
+    """Copy-join inputs that share a layout but may come from different encoders
+
+    An MP4 keeps one decoder config, the first input's, so a plain concat of
+    files with different H.264/HEVC profiles, levels or SPS/PPS corrupts the
+    rest. Each input goes through MPEG-TS with its config in-band first, as
+    smart_cut() and the chunked encoder do.
+    """
+    ts_paths = []
+    try:
+        for i, path in enumerate(input_paths):
+            ts_path = f"{output_path}.join{i}.ts"
+            ts_paths.append(ts_path)
+            args = ['-i', path, '-map', '0:V:0?', '-map', '0:a:0?', '-c', 'copy']
+            if video_codec in IN_BAND_BSF:
+                args += ['-bsf:v', IN_BAND_BSF[video_codec]]
+            run_ffmpeg([*args, '-f', 'mpegts', ts_path])
+        concat_copy(ts_paths, output_path)
+    finally:
+        for path in ts_paths:
+            if os.path.exists(path):
+                os.unlink(path)
+
+def _copy_video_range(input_path: str, start: float, end: float, output_path: str, stream: dict):
+    # start is a keyframe, so an input-side seek lands exactly on it
+    run_ffmpeg([
+        '-ss', f"{start:.6f}",
+        '-i', input_path,
+        '-t', f"{end - start:.6f}",
+        '-map', '0:V:0',
+        '-c', 'copy',
+        '-bsf:v', f"{stream['codec']}_mp4toannexb",
+        '-f', 'mpegts',
+        output_path,
+    ])
+
+def _encode_video_range(input_path: str, start: float, end: float, output_path: str, stream: dict):
+    args = [
+        '-ss', f"{start:.6f}",
+        '-i', input_path,
+        '-t', f"{end - start:.6f}",
+        '-map', '0:V:0',
+        '-c:v', SMART_CUT_ENCODERS[stream['codec']],
+        '-preset', 'veryfast',
+        '-crf', '18',
+    ]
+    if stream.get('pix_fmt'):
+        args += ['-pix_fmt', stream['pix_fmt']]
+    args += ['-f', 'mpegts', output_path]
+    run_ffmpeg(args)
+
+def smart_cut(input_path: str, start: float, end: float, output_path: str,
+              keyframes: List[float], video_stream: dict, has_audio: bool):
+    """Frame-accurate cut that re-encodes only the partial GOPs at each edge"""
+    inner = [k for k in keyframes if start <= k <= end]
+    suffix = f".{video_stream['codec']}.ts"
+    segments = []
+    
+    try:
+        if not inner:
+            # The whole range sits inside one GOP
+            path = f"{output_path}.part0{suffix}"
+            _encode_video_range(input_path, start, end, path, video_stream)
+            segments.append(path)
+        else:
+            head_end, tail_start = inner[0], inner[-1]
+            if head_end - start > _EDGE_EPSILON:
+                path = f"{output_path}.head{suffix}"
+                _encode_video_range(input_path, start, head_end, path, video_stream)
+                segments.append(path)
+            if tail_start - head_end > _EDGE_EPSILON:
+                path = f"{output_path}.mid{suffix}"
+                _copy_video_range(input_path, head_end, tail_start, path, video_stream)
+                segments.append(path)
+            if end - tail_start > _EDGE_EPSILON:
+                path = f"{output_path}.tail{suffix}"
+                _encode_video_range(input_path, tail_start, end, path, video_stream)
+                segments.append(path)
+        
+        video_path = f"{output_path}.video{suffix}"
+        segments.append(video_path)
+        concat_copy(segments[:-1], video_path)
+        
+        # Audio is cheap to encode, so cut it sample-accurately from the source
+        args = ['-i', video_path]
+        if has_audio:
+            args += ['-ss', f"{start:.6f}", '-to', f"{end:.6f}", '-i', input_path]
+        args += ['-map', '0:v:0']
+        if has_audio:
+            args += ['-map', '1:a:0', '-c:a', _audio_encoder(output_path), '-shortest']
+        args += ['-c:v', 'copy', *_container_flags(output_path), output_path]
+        run_ffmpeg(args)
+    finally:
+        for path in segments:
+            if os.path.exists(path):
+                os.unlink(path)
+
+# Encoders used to bring mismatched merge inputs onto the reference layout
+NORMALIZE_VIDEO_ENCODERS = {
+    'h264': 'libx264',
+    'hevc': 'libx265',
+    'mpeg4': 'mpeg4',
+}
+NORMALIZE_AUDIO_ENCODERS = {
+    'aac': 'aac',
+    'mp3': 'libmp3lame',
+    'ac3': 'ac3',
+}
+
+def normalize(input_path: str, output_path: str, target: dict, has_audio: bool):
+    """Re-encode input to the target video/audio layout so it can be copy-concatenated"""
+    video, audio = target['video'], target['audio']
+    width, height = video['width'], video['height']
+    args = ['-i', input_path]
+    
+    if audio and not has_audio:
+        layout = audio.get('channel_layout') or 'stereo'
+        args += ['-f', 'lavfi', '-i', f"anullsrc=r={audio['sample_rate']}:cl={layout}"]
+    
+    filters = [
+        f"scale={width}:{height}:force_original_aspect_ratio=decrease",
+        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2",
+        "setsar=1",
+    ]
+    if video.get('frame_rate') and video['frame_rate'] != '0/0':
+        filters.append(f"fps={video['frame_rate']}")
+    
+    video_encoder = NORMALIZE_VIDEO_ENCODERS[video['codec']]
+    args += [
+        '-map', '0:V:0',
+        '-vf', ','.join(filters),
+        '-c:v', video_encoder,
+        # -q:v for mpeg4, which ignores -crf and would fall back to 200 kb/s
+        *_video_quality(video_encoder),
+        *_threads(),
+    ]
+    if video.get('pix_fmt'):
+        args += ['-pix_fmt', video['pix_fmt']]
+    if video.get('time_base'):
+        args += ['-video_track_timescale', video['time_base'].split('/')[-1]]
+    
+    if audio:
+        args += [
+            '-map', '0:a:0' if has_audio else '1:a:0',
+            '-c:a', NORMALIZE_AUDIO_ENCODERS[audio['codec']],
+            '-ar', str(audio['sample_rate']),
+        ]
+        if audio.get('channels'):
+            args += ['-ac', str(audio['channels'])]
+        if not has_audio:
+            args += ['-shortest']
+    else:
+        args += ['-an']
+    
+    args += [*_container_flags(output_path), output_path]
+    run_ffmpeg(args)
+
+def replace_audio(video_path: str, audio_path: str, output_path: str, copy_audio: bool,
+                  duration_mode: str = 'shortest', pad_seconds: float = 0):
+    """Mux the video stream untouched with a new soundtrack
+
+    duration_mode 'shortest' stops at the shorter input; 'pad' keeps the full
+    video, padding the audio with pad_seconds of silence when it is shorter.
+    """
+    args = [
+        '-i', video_path,
+        '-i', audio_path,
+        '-map', '0:V:0', '-map', '1:a:0',
+        '-c:v', 'copy',
+    ]
+    if duration_mode == 'pad' and pad_seconds > 0:
+        # Padding is a filter, so the audio has to be encoded
+        args += ['-af', f"apad=pad_dur={pad_seconds:.3f}", '-c:a', _audio_encoder(output_path)]
+    elif copy_audio:
+        args += ['-c:a', 'copy']
+    else:
+        args += ['-c:a', _audio_encoder(output_path)]
+    args += ['-shortest', *_container_flags(output_path), output_path]
+    run_ffmpeg(args)
+
+AUDIO_ENCODERS = {
+    'mp3': ['-c:a', 'libmp3lame', '-q:a', '2'],
+    'aac': ['-c:a', 'aac', '-b:a', '192k'],
+    'm4a': ['-c:a', 'aac', '-b:a', '192k'],
+    'wav': ['-c:a', 'pcm_s16le'],
+}
+
+def extract_audio(input_path: str, output_path: str, audio_format: str, copy_audio: bool):
+    """Write the first audio stream to output_path, never touching video frames"""
+    args = ['-i', input_path, '-map', '0:a:0', '-vn', '-sn', '-dn']
+    if copy_audio:
+        args += ['-c:a', 'copy']
+    else:
+        args += AUDIO_ENCODERS[audio_format]
+    if audio_format == 'aac':
+        args += ['-f', 'adts']
+    args += [*_container_flags(output_path), output_path]
+    run_ffmpeg(args)
+
+# Video/audio encoders per output container for chunked transcodes
+CHUNK_ENCODERS = {
+    'mp4': ('libx264', 'aac'),
+    'mov': ('libx264', 'aac'),
+    'mkv': ('libx264', 'aac'),
+    'avi': ('mpeg4', 'libmp3lame'),
+}
+
+def _video_quality(video_encoder: str) -> List[str]:
+    """Rate control for video_encoder from the job's encoding profile"""
+    profile = profiles.current()
+    if video_encoder in ('mpeg4', 'wmv2'):
+        return ['-q:v', str(profile['qscale'])]
+    return ['-preset', profile['preset'], '-crf', str(profile['crf'])]
+
+def _threads() -> List[str]:
+    threads = profiles.current()['threads']
+    return ['-threads', str(threads)] if threads else []
+
+def encode_chunk(input_path: str, start: float, end: float, output_path: str,
+                 video_encoder: str, threads: int):
+    """Encode the video of [start, end) to an MPEG-TS segment; start must be a keyframe"""
+    quality = _video_quality(video_encoder)
+    run_ffmpeg([
+        '-ss', f"{start:.6f}",
+        '-i', input_path,
+        '-t', f"{end - start:.6f}",
+        '-map', '0:V:0',
+        '-c:v', video_encoder,
+        *quality,
+        '-pix_fmt', 'yuv420p',
+        '-threads', str(threads),
+        '-an',
+        '-f', 'mpegts',
+        output_path,
+    ])
+
+def encode_audio(input_path: str, output_path: str, audio_encoder: str):
+    """Encode only the first audio stream of input_path"""
+    run_ffmpeg(['-i', input_path, '-map', '0:a:0', '-vn', '-c:a', audio_encoder, output_path])
+
+# Encoders for a full single-pass re-encode, per output container
+TRANSCODE_ENCODERS = dict(CHUNK_ENCODERS, wmv=('wmv2', 'wmav2'))
+
+def _encode_args(output_path: str) -> List[str]:
+    container = os.path.splitext(output_path)[1].lstrip('.').lower()
+    if container not in TRANSCODE_ENCODERS:
+        # Let ffmpeg pick the container's default codecs
+        return []
+    video_encoder, audio_encoder = TRANSCODE_ENCODERS[container]
+    return [
+        '-c:v', video_encoder, *_video_quality(video_encoder), *_threads(),
+        '-pix_fmt', 'yuv420p', '-c:a', audio_encoder,
+    ]
+
+def transcode(input_path: str, output_path: str, start: Optional[float] = None, end: Optional[float] = None):
+    """Re-encode video and audio in one pass, optionally only [start, end)"""
+    args = []
+    if start is not None:
+        args += ['-ss', f"{start:.6f}"]
+    args += ['-i', input_path]
+    if end is not None:
+        args += ['-t', f"{end - (start or 0):.6f}"]
+    args += [
+        '-map', '0:V:0', '-map', '0:a:0?',
+        *_encode_args(output_path),
+        *_container_flags(output_path),
+        output_path,
+    ]
+    run_ffmpeg(args)
+
+def concat_encode(input_paths: List[str], output_path: str, width: int, height: int,
+                  durations: List[float], has_audio: List[bool]):
+    """Re-encode inputs of any layout into one video of width x height
+
+    Pictures are scaled and letterboxed to fit; inputs without sound get
+    silence, so the soundtrack stays in sync when only some have audio.
+    """
+    args = []
+    for path in input_paths:
+        args += ['-i', path]
+    with_audio = any(has_audio)
+    filters, pairs = [], []
+    silence = len(input_paths)
+    for i, duration in enumerate(durations):
+        filters.append(
+            f"[{i}:V:0]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,format=yuv420p[v{i}]"
+        )
+        pair = f"[v{i}]"
+        if with_audio:
+            if has_audio[i]:
+                source = f"[{i}:a:0]"
+            else:
+                args += ['-f', 'lavfi', '-t', f"{duration:.6f}", '-i', "anullsrc=r=48000:cl=stereo"]
+                source = f"[{silence}:a]"
+                silence += 1
+            filters.append(f"{source}aformat=sample_rates=48000:channel_layouts=stereo[a{i}]")
+            pair += f"[a{i}]"
+        pairs.append(pair)
+    outputs = "[v][a]" if with_audio else "[v]"
+    filters.append(f"{''.join(pairs)}concat=n={len(input_paths)}:v=1:a={int(with_audio)}{outputs}")
+    args += ['-filter_complex', ';'.join(filters), '-map', '[v]']
+    if with_audio:
+        args += ['-map', '[a]']
+    args += [*_encode_args(output_path), *_container_flags(output_path), output_path]
+    run_ffmpeg(args)
+
+def mux_encode(video_path: str, audio_path: str, output_path: str):
+    """Re-encode video_path's picture with audio_path as its soundtrack"""
+    run_ffmpeg([
+        '-i', video_path,
+        '-i', audio_path,
+        '-map', '0:V:0', '-map', '1:a:0',
+        *_encode_args(output_path),
+        '-shortest',
+        *_container_flags(output_path),
+        output_path,
+    ])
+
+def split_ranges(input_path: str, ranges: List[tuple], output_paths: List[str], has_audio: bool):
+    """Cut several (start, end) ranges from one decode of the input
+
+    The decoded stream is fanned out with split/asplit, trimmed per range and
+    encoded to one output per range.
+    """
+    offset = min(start for start, _ in ranges)
+    last = max(end for _, end in ranges)
+    count = len(ranges)
+    
+    graph = [f"[0:V:0]split={count}" + ''.join(f"[v{i}]" for i in range(count))]
+    if has_audio:
+        graph.append(f"[0:a:0]asplit={count}" + ''.join(f"[a{i}]" for i in range(count)))
+    for i, (start, end) in enumerate(ranges):
+        # Timestamps are relative to the input-side seek to `offset`
+        trim = f"start={start - offset:.6f}:end={end - offset:.6f}"
+        graph.append(f"[v{i}]trim={trim},setpts=PTS-STARTPTS[vo{i}]")
+        if has_audio:
+            graph.append(f"[a{i}]atrim={trim},asetpts=PTS-STARTPTS[ao{i}]")
+    
+    args = [
+        '-ss', f"{offset:.6f}",
+        '-to', f"{last:.6f}",
+        '-i', input_path,
+        '-filter_complex', ';'.join(graph),
+    ]
+    for i, output_path in enumerate(output_paths):
+        args += ['-map', f"[vo{i}]", '-c:v', 'libx264', *_video_quality('libx264'), *_threads()]
+        if has_audio:
+            args += ['-map', f"[ao{i}]", '-c:a', 'aac']
+        args += [*_container_flags(output_path), output_path]
+    run_ffmpeg(args)
+
+def split_segments(input_path: str, segment_length: float, output_pattern: str):
+    """Cut the input into consecutive segment_length clips in a single encode
+
+    Keyframes are forced at every boundary so the segment muxer can cut
+    exactly there.
+    """
+    run_ffmpeg([
+        '-i', input_path,
+        '-map', '0:V:0', '-map', '0:a:0?',
+        '-c:v', 'libx264', *_video_quality('libx264'), *_threads(),
+        '-force_key_frames', f"expr:gte(t,n_forced*{segment_length})",
+        '-c:a', 'aac',
+        '-f', 'segment',
+        '-segment_time', f"{segment_length}",
+        '-reset_timestamps', '1',
+        '-segment_format_options', f"movflags={_movflags(output_pattern)}",
+        output_pattern,
+    ])
+
+# Muxer names for tee slaves, which can't guess the format from the path
+TEE_FORMATS = {
+    'mp4': 'mp4',
+    'mov': 'mov',
+    'mkv': 'matroska',
+    'avi': 'avi',
+    'm4a': 'ipod',
+    'aac': 'adts',
+    'mp3': 'mp3',
+    'wav': 'wav',
+}
+
+# Audio codec each audio_* format gets when it has to be encoded
+AUDIO_FORMAT_ENCODERS = {
+    'mp3': 'libmp3lame',
+    'aac': 'aac',
+    'm4a': 'aac',
+    'wav': 'pcm_s16le',
+}
+
+def _tee_slave(fmt: str, path: str, audio_only: bool = False) -> str:
+    options = [f"f={TEE_FORMATS[fmt]}"]
+    if _movflags(path):
+        options.append(f"movflags={_movflags(path)}")
+    if audio_only:
+        options.append("select=a")
+    return f"[{':'.join(options)}]{path}"
+
+def batch_convert(input_path: str, video_targets: dict, audio_targets: dict,
+                  video_copy: list, audio_copy: list):
+    """Write every requested format from a single decode of the input
+
+    video_targets/audio_targets map format -> output path. Formats listed in
+    video_copy/audio_copy are stream-copied. The rest share one encode per
+    codec pair, fanned out to their containers through the tee muxer, and
+    audio formats reuse the audio encoded for those groups when codecs match.
+    """
+    args = ['-i', input_path]
+    
+    for fmt in video_copy:
+        args += ['-map', '0:V?', '-map', '0:a?', '-c', 'copy',
+                 *_container_flags(video_targets[fmt]), video_targets[fmt]]
+    for fmt in audio_copy:
+        args += ['-map', '0:a:0', '-vn', '-c:a', 'copy']
+        if fmt == 'aac':
+            args += ['-f', 'adts']
+        args += [*_container_flags(audio_targets[fmt]), audio_targets[fmt]]
+    
+    # One encode per (video, audio) encoder pair
+    groups = {}
+    for fmt, path in video_targets.items():
+        if fmt not in video_copy:
+            groups.setdefault(CHUNK_ENCODERS[fmt], []).append(_tee_slave(fmt, path))
+    
+    pending_audio = [fmt for fmt in audio_targets if fmt not in audio_copy]
+    for (video_encoder, audio_encoder), slaves in groups.items():
+        for fmt in list(pending_audio):
+            if AUDIO_FORMAT_ENCODERS[fmt] == audio_encoder:
+                slaves.append(_tee_slave(fmt, audio_targets[fmt], audio_only=True))
+                pending_audio.remove(fmt)
+        
+        quality = _video_quality(video_encoder)
+        args += [
+            '-map', '0:V:0', '-map', '0:a:0?',
+            '-c:v', video_encoder, *quality, *_threads(), '-pix_fmt', 'yuv420p',
+            '-c:a', audio_encoder,
+            # tee can't ask each muxer whether it needs global headers
+            '-flags', '+global_header',
+            '-f', 'tee', '|'.join(slaves),
+        ]
+    
+    # Audio formats no video group could share, one encode per codec
+    audio_groups = {}
+    for fmt in pending_audio:
+        audio_groups.setdefault(AUDIO_FORMAT_ENCODERS[fmt], []).append(
+            _tee_slave(fmt, audio_targets[fmt], audio_only=True)
+        )
+    for audio_encoder, slaves in audio_groups.items():
+        args += ['-map', '0:a:0', '-vn', '-c:a', audio_encoder, '-f', 'tee', '|'.join(slaves)]
+    
+    run_ffmpeg(args)
@@ -0,0 +1,179 @@
+import os
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict
+from config import INPUT_CACHE_DIR, INPUT_CACHE_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Files derived from an input that live next to it and go with it on eviction
+SIDECAR_SUFFIXES = ['.keyframes.json']
+
+class _Entry:
+    __slots__ = ('path', 'size', 'refs', 'external')
+
+    def __init__(self, path: str, size: int, external: bool = False):
+        self.path = path
+        self.size = size
+        self.refs = 0
+        # A link to someone else's file, used in place: never counted, and
+        # eviction removes only the link and its sidecars
+        self.external = external
+
+class InputStore:
+    """Downloaded inputs shared across users, keyed by Telegram file_unique_id
+
+    Concurrent fetches of one file share a single download, files in use by a
+    job are pinned by reference count, and the least recently used unpinned
+    files are deleted to keep the store under max_bytes.
+    """
+    def __init__(self, root: str = INPUT_CACHE_DIR, max_bytes: int = INPUT_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def start(self):
+        """Re-adopt inputs from before a restart and drop what they left half done
+
+        Only the bot calls this: spawned pool workers import this module too,
+        and must not touch downloads the bot has in flight.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        # Oldest access first
+        files = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.endswith('.part'):
+                os.unlink(path)
+                continue
+            if any(name.endswith(suffix) for suffix in SIDECAR_SUFFIXES):
+                continue
+            external = os.path.islink(path)
+            if external and not os.path.exists(path):
+                # The server deleted the file behind the link
+                self._unlink(path)
+                continue
+            if not os.path.isfile(path):
+                continue
+            stat = os.lstat(path)
+            files.append((stat.st_atime, os.path.splitext(name)[0], path, 0 if external else stat.st_size, external))
+        for _, key, path, size, external in sorted(files):
+            self._entries[key] = _Entry(path, size, external)
+            self.total_bytes += size
+
+    def _path_for(self, key: str, ext: str) -> str:
+        return os.path.join(self.root, f"{key}{ext}")
+
+    async def fetch(self, key: str, ext: str, download: Callable[[str], Awaitable]) -> str:
+        """Return the local path for key, calling download(path) at most once at a time
+
+        download may instead return the path of a file that is already on
+        local disk, which is then used in place without a copy. It is linked
+        under key all the same, so files derived from it (the keyframe index)
+        land in this store instead of next to someone else's file.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and os.path.exists(entry.path):
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.path
+
+        if key in self._inflight:
+            self.hits += 1
+            return await asyncio.shield(self._inflight[key])
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        path = self._path_for(key, ext)
+        try:
+            part_path = f"{path}.part"
+            located = await download(part_path)
+            if located is not None:
+                os.symlink(os.path.abspath(located), part_path)
+                os.replace(part_path, path)
+                new_entry = _Entry(path, 0, external=True)
+            else:
+                os.replace(part_path, path)
+                new_entry = _Entry(path, os.path.getsize(path))
+
+            if entry is not None:
+                self.total_bytes -= entry.size
+            entry = new_entry
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self.total_bytes += entry.size
+            future.set_result(entry.path)
+        except asyncio.CancelledError:
+            self._discard_part(path)
+            future.cancel()
+            raise
+        except Exception as e:
+            self._discard_part(path)
+            future.set_exception(e)
+            # Mark retrieved so a download nobody else waited on doesn't warn
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+        # Never evict the file we are about to hand out
+        self._evict(keep=key)
+        return entry.path
+
+    def _discard_part(self, path: str):
+        if os.path.lexists(f"{path}.part"):
+            os.unlink(f"{path}.part")
+
+    def _unlink(self, path: str):
+        for victim in [path] + [path + suffix for suffix in SIDECAR_SUFFIXES]:
+            try:
+                os.unlink(victim)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not evict {victim}: {e}")
+
+    def acquire(self, key: str):
+        """Pin key so eviction leaves it alone while a job reads it"""
+        self._entries[key].refs += 1
+
+    def release(self, key: str):
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.refs = max(0, entry.refs - 1)
+        self._evict()
+
+    @asynccontextmanager
+    async def use(self, key: str, ext: str, download: Callable[[str], Awaitable]):
+        """Fetch key and keep it pinned for the duration of the block"""
+        path = await self.fetch(key, ext, download)
+        while key not in self._entries:
+            # Evicted between the download finishing and this task resuming
+            path = await self.fetch(key, ext, download)
+        self.acquire(key)
+        try:
+            yield path
+        finally:
+            self.release(key)
+
+    def _evict(self, keep: str = None):
+        if self.total_bytes <= self.max_bytes:
+            return
+        for key in list(self._entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            entry = self._entries[key]
+            if entry.refs > 0 or key == keep:
+                continue
+            self._unlink(entry.path)
+            del self._entries[key]
+            self.total_bytes -= entry.size
+
+input_store = InputStore()
@@ -0,0 +1,62 @@
+import asyncio
+from typing import Optional
+from config import JOB_BACKEND
+from video_processor import VideoProcessor
+from executor import job_scope
+import profiles
+
+# VideoProcessor methods a job may name. Every one takes JSON-serializable
+# positional arguments, a progress_callback keyword and returns paths.
+OPERATIONS = {
+    'convert_video', 'batch_convert', 'merge_videos', 'video_to_audio',
+    'split_video', 'split_video_ranges', 'split_video_segments', 'merge_video_audio',
+}
+
+async def run_operation(method: str, args: list, progress_callback=None, profile: Optional[str] = None) -> dict:
+    """Run VideoProcessor.<method>(*args), encoding with the named profile
+
+    Returns {'result': <the method's result>, 'profile': name}, where the
+    profile is None unless an encode actually used it.
+    """
+    if method not in OPERATIONS:
+        raise ValueError(f"Unknown operation {method}")
+    with profiles.using(profile) as scope, job_scope():
+        result = await getattr(VideoProcessor, method)(*args, progress_callback=progress_callback)
+    return {'result': result, 'profile': scope.name if scope.applied else None}
+
+class LocalRunner:
+    """Runs operations in this process's own worker pool"""
+    async def run(self, method: str, args: list, progress_callback=None, reply: Optional[dict] = None,
+                  profile: Optional[str] = None):
+        return await run_operation(method, args, progress_callback, profile)
+
+    def start(self):
+        pass
+
+class BrokerRunner:
+    """Hands operations to worker.py processes through the broker
+
+    Inputs and the output directory are passed as paths, and the queue is a
+    local SQLite file, so workers must run on this host (see worker.py).
+    """
+    def __init__(self, broker):
+        self.broker = broker
+
+    async def run(self, method: str, args: list, progress_callback=None, reply: Optional[dict] = None,
+                  profile: Optional[str] = None):
+        if method not in OPERATIONS:
+            raise ValueError(f"Unknown operation {method}")
+        job_id = await asyncio.to_thread(self.broker.enqueue, method, list(args), reply, profile)
+        return await self.broker.wait(job_id, progress_callback)
+
+    def start(self):
+        # Their job directories were reclaimed on startup and nobody awaits them
+        self.broker.cancel_pending()
+
+def _make_runner():
+    if JOB_BACKEND == "broker":
+        from broker import Broker
+        return BrokerRunner(Broker())
+    return LocalRunner()
+
+job_runner = _make_runner()
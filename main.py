@@ -0,0 +1,12 @@
+"""Entry point: python main.py
+
+The worker pool uses the spawn start method, and every spawned process
+re-imports the main module as __mp_main__. Started as bot.py, that pulled
+python-telegram-bot and every bot module into each pool worker; this module
+imports nothing until it actually runs, so workers only load what the
+functions they run need.
+"""
+
+if __name__ == "__main__":
+    from bot import main
+    main()
@@ -0,0 +1,239 @@
+import os
+import json
+import subprocess
+from typing import Dict, List, Optional
+import ffmpeg
+
+FFPROBE_BIN = 'ffprobe'
+
+# Codecs each output container can carry without re-encoding.
+# None means the container accepts any codec of that kind.
+CONTAINER_CODECS = {
+    'mp4': {
+        'video': {'h264', 'hevc', 'mpeg4', 'av1'},
+        'audio': {'aac', 'mp3', 'ac3', 'eac3', 'alac'},
+    },
+    'mov': {
+        'video': {'h264', 'hevc', 'mpeg4', 'prores', 'mjpeg'},
+        'audio': {'aac', 'mp3', 'ac3', 'alac', 'pcm_s16le', 'pcm_s24le'},
+    },
+    'mkv': {
+        'video': None,
+        'audio': None,
+    },
+    'avi': {
+        'video': {'mpeg4', 'mjpeg', 'msmpeg4v3'},
+        'audio': {'mp3', 'ac3', 'pcm_s16le'},
+    },
+}
+
+# Audio codecs each audio_* output format can hold as-is
+AUDIO_FORMAT_CODECS = {
+    'mp3': {'mp3'},
+    'aac': {'aac'},
+    'm4a': {'aac', 'alac'},
+    'wav': {'pcm_s16le', 'pcm_s24le', 'pcm_s32le', 'pcm_f32le', 'pcm_u8'},
+}
+
+def _stream_info(stream: dict) -> dict:
+    return {
+        'index': stream.get('index'),
+        'codec': stream.get('codec_name'),
+        'width': stream.get('width'),
+        'height': stream.get('height'),
+        'pix_fmt': stream.get('pix_fmt'),
+        'time_base': stream.get('time_base'),
+        'frame_rate': stream.get('avg_frame_rate'),
+        'sample_rate': stream.get('sample_rate'),
+        'channels': stream.get('channels'),
+        'channel_layout': stream.get('channel_layout'),
+    }
+
+def probe_media(path: str) -> Dict:
+    """Probe a media file and return its container, duration and streams"""
+    data = ffmpeg.probe(path)
+    video_streams: List[dict] = []
+    audio_streams: List[dict] = []
+    
+    for stream in data.get('streams', []):
+        if stream.get('codec_type') == 'video':
+            # Cover art in mkv/mp4 shows up as a single-frame video stream
+            if stream.get('disposition', {}).get('attached_pic'):
+                continue
+            video_streams.append(_stream_info(stream))
+        elif stream.get('codec_type') == 'audio':
+            audio_streams.append(_stream_info(stream))
+    
+    fmt = data.get('format', {})
+    return {
+        'format_name': fmt.get('format_name', ''),
+        'duration': float(fmt.get('duration') or 0),
+        'size': int(fmt.get('size') or 0),
+        'video': video_streams,
+        'audio': audio_streams,
+    }
+
+def codecs_fit_container(info: Dict, container: str) -> bool:
+    """Check whether every video/audio stream can be stream-copied into container"""
+    allowed = CONTAINER_CODECS.get(container)
+    if allowed is None:
+        return False
+    
+    for kind in ('video', 'audio'):
+        codecs: Optional[set] = allowed[kind]
+        if codecs is None:
+            continue
+        for stream in info[kind]:
+            if stream['codec'] not in codecs:
+                return False
+    return True
+
+def audio_fits_format(info: Dict, audio_format: str) -> bool:
+    """Check whether the first audio stream can be copied into audio_format"""
+    codecs = AUDIO_FORMAT_CODECS.get(audio_format, set())
+    return bool(info['audio']) and info['audio'][0]['codec'] in codecs
+
+def select_convert_mode(info: Dict, output_format: str, chunked_min_duration: float = None) -> str:
+    """Pick 'remux' when streams fit the target container, else 'transcode'
+
+    Transcodes of at least chunked_min_duration seconds become 'chunked', to
+    be split at keyframes and encoded in parallel.
+    """
+    if not info['video']:
+        return 'transcode'
+    if codecs_fit_container(info, output_format):
+        return 'remux'
+    if chunked_min_duration is not None and info['duration'] >= chunked_min_duration:
+        return 'chunked'
+    return 'transcode'
+
+def plan_chunks(keyframes: List[float], duration: float, workers: int,
+                min_seconds: float, chunks_per_worker: int = 2) -> List[tuple]:
+    """Split [0, duration) at keyframes into about workers*chunks_per_worker chunks
+
+    A few chunks per worker keeps every core busy even when some chunks encode
+    slower than others; chunks never get shorter than min_seconds.
+    """
+    target = max(min_seconds, duration / max(1, workers * chunks_per_worker))
+    boundaries = [0.0]
+    for keyframe in keyframes:
+        if keyframe - boundaries[-1] >= target and duration - keyframe >= min_seconds:
+            boundaries.append(keyframe)
+    boundaries.append(duration)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def _read_keyframes(path: str) -> List[float]:
+    # Packet flags come from the demuxer, so no frame is decoded here
+    cmd = [
+        FFPROBE_BIN, '-v', 'error',
+        '-select_streams', 'V:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        path,
+    ]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise ffmpeg.Error(FFPROBE_BIN, proc.stdout, proc.stderr)
+    
+    keyframes = []
+    for line in proc.stdout.decode(errors='ignore').splitlines():
+        parts = line.strip().split(',')
+        if len(parts) < 2 or 'K' not in parts[1]:
+            continue
+        try:
+            keyframes.append(float(parts[0]))
+        except ValueError:
+            continue
+    return sorted(set(keyframes))
+
+def keyframe_index(path: str) -> List[float]:
+    """Return keyframe timestamps for the first video stream, cached next to the file
+
+    Inputs come from the input store, so the cache lands in INPUT_CACHE_DIR
+    under the file's file_unique_id and is evicted with it.
+    """
+    cache_path = f"{path}.keyframes.json"
+    stat = os.stat(path)
+    
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached.get('size') == stat.st_size and cached.get('mtime') == stat.st_mtime:
+            return cached['keyframes']
+    except (OSError, ValueError, KeyError):
+        pass
+    
+    keyframes = _read_keyframes(path)
+    try:
+        with open(cache_path, 'w') as f:
+            json.dump({'size': stat.st_size, 'mtime': stat.st_mtime, 'keyframes': keyframes}, f)
+    except OSError:
+        pass
+    return keyframes
+
+def merge_signature(info: Dict) -> tuple:
+    """Stream properties that must match for a stream-copy concat"""
+    video = info['video'][0] if info['video'] else {}
+    audio = info['audio'][0] if info['audio'] else {}
+    return (
+        video.get('codec'), video.get('width'), video.get('height'),
+        video.get('pix_fmt'), video.get('frame_rate'), video.get('time_base'),
+        audio.get('codec'), audio.get('sample_rate'),
+        audio.get('channels'), audio.get('channel_layout'),
+    )
+
+def plan_merge(infos: List[Dict], video_codecs, audio_codecs) -> Dict:
+    """Choose the target layout and the inputs that must be normalized to it
+
+    video_codecs/audio_codecs are the codecs we can encode when normalizing.
+    """
+    signatures = [merge_signature(info) for info in infos]
+    has_audio = any(info['audio'] for info in infos)
+    # A silent reference would strip every other input's sound, so while any
+    # input has audio only inputs with audio qualify; silent ones get anullsrc
+    candidates = [
+        i for i, info in enumerate(infos) if info['video'] and (info['audio'] or not has_audio)
+    ] or list(range(len(infos)))
+    
+    def rank(i: int) -> tuple:
+        video = infos[i]['video'][0] if infos[i]['video'] else {}
+        # The most common layout needs the fewest inputs re-encoded; ties go
+        # to the largest frame, then to the earliest input
+        return (signatures.count(signatures[i]), (video.get('width') or 0) * (video.get('height') or 0), -i)
+    
+    ref_index = max(candidates, key=rank)
+    reference = signatures[ref_index]
+    ref_info = infos[ref_index]
+    ref_video = ref_info['video'][0] if ref_info['video'] else None
+    ref_audio = ref_info['audio'][0] if ref_info['audio'] else None
+    
+    if (ref_video and ref_video['codec'] in video_codecs
+            and (ref_audio is None or ref_audio['codec'] in audio_codecs)
+            and codecs_fit_container(ref_info, 'mp4')):
+        return {
+            'target': {'video': ref_video, 'audio': ref_audio},
+            'normalize': [i for i, sig in enumerate(signatures) if sig != reference],
+        }
+    
+    # The reference can't be copied into the merged MP4, so everything is
+    # normalized to H.264/AAC at the first video's geometry
+    first_video = next((info['video'][0] for info in infos if info['video']), {})
+    return {
+        'target': {
+            'video': {
+                'codec': 'h264',
+                'width': first_video.get('width'),
+                'height': first_video.get('height'),
+                'pix_fmt': 'yuv420p',
+                'frame_rate': first_video.get('frame_rate'),
+                'time_base': None,
+            },
+            'audio': {
+                'codec': 'aac',
+                'sample_rate': '48000',
+                'channels': 2,
+                'channel_layout': 'stereo',
+            } if has_audio else None,
+        },
+        'normalize': list(range(len(infos))),
+    }
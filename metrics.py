@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+from config import TEMP_DIR, METRICS_HOST, METRICS_PORT, METRICS_TRACE_DIR, LOOP_LAG_INTERVAL
+from scheduler import JobRejected
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans everything from a cached reply to a long encode
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names: Tuple[str, ...], values: Tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), fn: Callable = None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # Read at scrape time instead of being pushed; returns a value, or a
+        # {label values tuple: value} dict for labelled metrics
+        self.fn = fn
+        self._values: Dict[Tuple, float] = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def samples(self) -> List[str]:
+        values = self._values
+        if self.fn is not None:
+            value = self.fn()
+            values = value if isinstance(value, dict) else {(): value}
+        return [f"{self.name}{_labels(self.labels, key)} {value}" for key, value in values.items()]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # label values -> (per-bucket counts incl. +Inf, sum)
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _labels(self.labels + ("le",), key + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+REGISTRY: List[_Metric] = []
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    blocks = []
+    for metric in REGISTRY:
+        try:
+            blocks.append(metric.render())
+        except Exception as e:
+            logger.warning(f"Could not collect {metric.name}: {e}")
+    return "\n".join(blocks) + "\n"
+
+# Hot-path metrics
+
+JOBS = Counter("bot_jobs_total", "Finished jobs by operation and outcome", ("operation", "outcome"))
+JOB_SECONDS = Histogram("bot_job_seconds", "End-to-end job latency", ("operation",))
+PHASE_SECONDS = Histogram(
+    "bot_phase_seconds", "Latency of each job phase (download, probe, queue, encode, upload)",
+    ("operation", "phase")
+)
+DOWNLOAD_BYTES = Counter("bot_download_bytes_total", "Bytes fetched from Telegram", ("operation",))
+UPLOAD_BYTES = Counter("bot_upload_bytes_total", "Bytes sent to Telegram", ("operation",))
+PROFILES = Counter("bot_encoding_profiles_total", "Jobs by the encoding profile their encodes used", ("operation", "profile"))
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Update handler latency", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Update handlers that raised", ("handler",))
+LOOP_LAG = Histogram(
+    "bot_event_loop_lag_seconds", "How late the event loop ran a timer",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+
+# Per-job context: operation label and optional trace
+
+class JobTrace:
+    """Phase spans of one job, written in Chrome trace format (chrome://tracing, Perfetto)"""
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.started = time.time()
+        self.events = []
+
+    def add(self, name: str, start: float, end: float, **args):
+        self.events.append({
+            'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': 0,
+            'ts': int(start * 1_000_000), 'dur': int((end - start) * 1_000_000), 'args': args,
+        })
+
+    def write(self, directory: str, outcome: str):
+        name = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started))}-{self.operation}-{id(self):x}.json"
+        self.add(self.operation, self.started, time.time(), outcome=outcome)
+        with open(os.path.join(directory, name), 'w') as f:
+            json.dump({'traceEvents': self.events}, f)
+
+class _JobContext:
+    __slots__ = ('operation', 'trace')
+
+    def __init__(self, operation: str, trace: Optional[JobTrace]):
+        self.operation = operation
+        self.trace = trace
+
+_current_job: contextvars.ContextVar = contextvars.ContextVar('current_job', default=None)
+
+def current_operation() -> str:
+    job = _current_job.get()
+    return job.operation if job is not None else "none"
+
+class track_job:
+    """Async context manager around one user request: counts the outcome,
+    times it end to end and labels the phases recorded inside it"""
+    def __init__(self, operation: str):
+        self.operation = operation
+
+    async def __aenter__(self):
+        trace = JobTrace(self.operation) if METRICS_TRACE_DIR else None
+        self._token = _current_job.set(_JobContext(self.operation, trace))
+        self._started = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        job = _current_job.get()
+        _current_job.reset(self._token)
+        if exc_type is None:
+            outcome = "ok"
+        elif issubclass(exc_type, JobRejected):
+            outcome = "rejected"
+        else:
+            outcome = "error"
+        JOBS.inc(operation=self.operation, outcome=outcome)
+        JOB_SECONDS.observe(time.monotonic() - self._started, operation=self.operation)
+        if job.trace is not None:
+            try:
+                await asyncio.to_thread(job.trace.write, METRICS_TRACE_DIR, outcome)
+            except OSError as e:
+                logger.warning(f"Could not write job trace: {e}")
+        return False
+
+def record_phase(name: str, start: float, end: float, **args):
+    """Record a phase of the current job that ran from start to end (time.time())"""
+    job = _current_job.get()
+    PHASE_SECONDS.observe(end - start, operation=current_operation(), phase=name)
+    if job is not None and job.trace is not None:
+        job.trace.add(name, start, end, **args)
+
+@contextmanager
+def phase(name: str, **args):
+    """Time one phase of the current job"""
+    start = time.time()
+    try:
+        yield
+    finally:
+        record_phase(name, start, time.time(), **args)
+
+def instrument(handler: Callable) -> Callable:
+    """Wrap a PTB handler callback with latency and error metrics"""
+    name = handler.__name__
+
+    async def wrapped(update, context):
+        start = time.monotonic()
+        try:
+            return await handler(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.monotonic() - start, handler=name)
+
+    wrapped.__name__ = name
+    return wrapped
+
+# Runtime state, read at scrape time
+
+def _dir_bytes(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def _register_runtime():
+    from scheduler import job_scheduler
+    from executor import job_executor
+    from workspace import workspace_manager
+    from input_store import input_store
+    from result_cache import result_cache
+
+    Gauge("bot_queue_depth", "Jobs waiting in the fair scheduler", fn=lambda: job_scheduler.queued)
+    Gauge("bot_running_jobs", "Jobs admitted by the scheduler", fn=lambda: job_scheduler.running)
+    Gauge("bot_executor_active_jobs", "Pool tasks running in this process", fn=lambda: job_executor.active_jobs)
+    Gauge("bot_active_workspaces", "Job directories in use", fn=lambda: workspace_manager.active_jobs)
+    Gauge("bot_temp_dir_bytes", "Bytes under the temp directory", fn=lambda: _dir_bytes(TEMP_DIR))
+    Gauge("bot_input_store_bytes", "Bytes of cached inputs", fn=lambda: input_store.total_bytes)
+    Counter("bot_cache_hits_total", "Cache hits", ("cache",), fn=lambda: {
+        ("result",): result_cache.hits, ("input",): input_store.hits,
+    })
+    Counter("bot_cache_misses_total", "Cache misses", ("cache",), fn=lambda: {
+        ("result",): result_cache.misses, ("input",): input_store.misses,
+    })
+
+async def _watch_loop_lag(interval: float):
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, time.monotonic() - start - interval))
+
+async def metrics_route(headers: Dict[str, str], body: bytes):
+    # Walking the temp dir can take a while; keep it off the event loop
+    text = await asyncio.to_thread(render)
+    return 200, "text/plain; version=0.0.4; charset=utf-8", text.encode()
+
+_tasks = []
+_server = None
+
+async def start():
+    """Start the lag watcher and, if METRICS_PORT is set, the /metrics endpoint"""
+    global _server
+    if not any(metric.name == "bot_queue_depth" for metric in REGISTRY):
+        _register_runtime()
+    if METRICS_TRACE_DIR:
+        os.makedirs(METRICS_TRACE_DIR, exist_ok=True)
+    _tasks.append(asyncio.get_running_loop().create_task(_watch_loop_lag(LOOP_LAG_INTERVAL)))
+    if METRICS_PORT:
+        from webhook import WebhookServer
+        _server = WebhookServer(METRICS_HOST, METRICS_PORT)
+        _server.add_route('GET', '/metrics', metrics_route)
+        await _server.start()
+
+async def stop():
+    global _server
+    for task in _tasks:
+        task.cancel()
+    _tasks.clear()
+    if _server is not None:
+        await _server.stop()
+        _server = None
@@ -0,0 +1,115 @@
+"""Encoding profiles and the policy that picks one per job
+
+The bot picks a profile when a job is queued. The profile name travels with
+the job to whichever process runs it, and the executor installs it in the
+pool worker that runs each encode step. Encoders then read their settings
+from current(), which also records that the profile was applied, so a job
+that only remuxed or stream-copied doesn't claim one.
+"""
+import os
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from config import (
+    MAX_CONCURRENT_JOBS, HEAVY_JOB_COST, ENCODING_PROFILE,
+    PROFILE_BUSY_QUEUE, PROFILE_SATURATED_QUEUE, PROFILE_QUALITY_MAX_COST
+)
+from scheduler import estimate_cost
+
+# With every slot busy, one encode per slot on its share of the cores beats
+# each encode contending for all of them
+_SHARED_THREADS = max(1, (os.cpu_count() or 1) // max(1, MAX_CONCURRENT_JOBS))
+
+# Slowest and best first. preset/crf drive x264 and x265, qscale the mpeg4
+# and wmv2 encoders; threads 0 leaves the count to the encoder.
+PROFILES = {
+    'quality': {'preset': 'medium', 'crf': 20, 'qscale': 3, 'threads': 0},
+    'balanced': {'preset': 'veryfast', 'crf': 23, 'qscale': 4, 'threads': 0},
+    'fast': {'preset': 'superfast', 'crf': 26, 'qscale': 6, 'threads': _SHARED_THREADS},
+    'turbo': {'preset': 'ultrafast', 'crf': 28, 'qscale': 8, 'threads': _SHARED_THREADS},
+}
+ORDER = list(PROFILES)
+DEFAULT_PROFILE = 'balanced'
+
+# Operations whose output is a video encode; audio and rename jobs never
+# touch the picture, so no profile applies to them
+VIDEO_OPERATIONS = {'convert', 'batch', 'merge', 'split', 'av_merge'}
+
+# Frames above 1080p take the longest per second of input
+_LARGE_MEGAPIXELS = 1920 * 1080 / 1_000_000
+
+if ENCODING_PROFILE and ENCODING_PROFILE not in PROFILES:
+    raise ValueError(f"Unknown ENCODING_PROFILE '{ENCODING_PROFILE}'; use one of {', '.join(PROFILES)}")
+
+def choose_profile(operation: str, infos: List[Dict], queued: int) -> Optional[str]:
+    """Profile for a job about to wait behind `queued` others, or None if it encodes no video
+
+    Idle boxes spend time on quality for small jobs. Every step of backlog,
+    and a long or high-resolution input while others wait, moves one
+    profile faster.
+    """
+    if operation not in VIDEO_OPERATIONS:
+        return None
+    if ENCODING_PROFILE:
+        return ENCODING_PROFILE
+
+    cost = estimate_cost(operation, infos)
+    megapixels = max(
+        ((info['video'][0]['width'] or 0) * (info['video'][0]['height'] or 0) / 1_000_000
+         for info in infos if info['video']),
+        default=0
+    )
+
+    step = ORDER.index(DEFAULT_PROFILE)
+    if queued == 0 and cost <= PROFILE_QUALITY_MAX_COST:
+        step -= 1
+    if queued >= PROFILE_BUSY_QUEUE:
+        step += 1
+    if queued >= PROFILE_SATURATED_QUEUE:
+        step += 1
+    if queued and (cost > HEAVY_JOB_COST or megapixels > _LARGE_MEGAPIXELS):
+        # The biggest jobs hold a slot longest, so they give up the most
+        step += 1
+    return ORDER[max(0, min(step, len(ORDER) - 1))]
+
+# Encoder side
+
+class _Scope:
+    __slots__ = ('name', 'applied')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.applied = False
+
+_active: contextvars.ContextVar = contextvars.ContextVar('encoding_profile', default=None)
+
+@contextmanager
+def using(name: Optional[str]):
+    """Make name the profile of the encodes started inside the block
+
+    Yields a scope whose `applied` turns True once an encode reads it.
+    """
+    scope = _Scope(name or DEFAULT_PROFILE)
+    token = _active.set(scope)
+    try:
+        yield scope
+    finally:
+        _active.reset(token)
+
+def active() -> str:
+    scope = _active.get()
+    return scope.name if scope is not None else DEFAULT_PROFILE
+
+def current() -> Dict:
+    """Settings of the profile in effect, for an encode about to use them"""
+    scope = _active.get()
+    if scope is None:
+        return PROFILES[DEFAULT_PROFILE]
+    scope.applied = True
+    return PROFILES[scope.name]
+
+def mark_applied():
+    """Record that a pool task submitted from this context encoded with the profile"""
+    scope = _active.get()
+    if scope is not None:
+        scope.applied = True
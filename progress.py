@@ -0,0 +1,90 @@
+from typing import Dict
+
+# Worker side: the executor installs a queue for the job running in this
+# process, and encoders report into it without knowing who is listening.
+# The stop flag is set when the job that submitted the task is cancelled.
+_sink = None
+_stop = None
+
+def set_sink(queue, stop=None):
+    global _sink, _stop
+    _sink = queue
+    _stop = stop
+
+def stopped() -> bool:
+    """True once the task this process is running was cancelled by its job"""
+    if _stop is None:
+        return False
+    try:
+        return _stop.is_set()
+    except Exception:
+        # The bot went away; nobody is left to want the result either
+        return True
+
+def report(out_time: float = None, speed: float = None, fraction: float = None):
+    """Publish encoder progress for the current job, if anyone is listening"""
+    if _sink is None:
+        return
+    try:
+        _sink.put_nowait({'out_time': out_time, 'speed': speed, 'fraction': fraction})
+    except Exception:
+        # Progress is best effort and must never fail an encode
+        pass
+
+def parse_ffmpeg_progress(line: str, state: Dict) -> bool:
+    """Fold one `-progress` key=value line into state, True at the end of a block"""
+    key, _, value = line.strip().partition('=')
+    if key in ('out_time_us', 'out_time_ms'):
+        # out_time_ms is also in microseconds, despite its name
+        try:
+            state['out_time'] = int(value) / 1_000_000
+        except ValueError:
+            pass
+    elif key == 'speed':
+        try:
+            state['speed'] = float(value.rstrip('x'))
+        except ValueError:
+            state['speed'] = None
+    return key == 'progress'
+
+def encoder_progress(progress_callback, duration: float, start: int, end: int, status: str):
+    """Map encoder reports for a job of `duration` seconds onto start..end percent"""
+    best = {'progress': start}
+
+    async def callback(item: Dict):
+        if item.get('fraction') is not None:
+            fraction = item['fraction']
+        elif item.get('out_time') is not None and duration:
+            fraction = item['out_time'] / duration
+        else:
+            return
+        progress = start + int((end - start) * min(max(fraction, 0.0), 1.0))
+        # Multi-step jobs restart out_time per step; never move backwards
+        if progress <= best['progress']:
+            return
+        best['progress'] = progress
+
+        text = status
+        if item.get('speed'):
+            text = f"{status} ({item['speed']:.1f}x)"
+        await progress_callback(progress, text)
+
+    return callback
+
+def parallel_progress(progress_callback, durations, start: int, end: int, status: str):
+    """One callback per parallel job, combined into a single start..end percentage"""
+    positions = [0.0] * len(durations)
+    combined = encoder_progress(progress_callback, sum(durations), start, end, status)
+
+    def for_job(n: int):
+        async def callback(item: Dict):
+            if item.get('fraction') is not None:
+                positions[n] = durations[n] * item['fraction']
+            elif item.get('out_time') is not None:
+                positions[n] = min(item['out_time'], durations[n])
+            else:
+                return
+            await combined({'out_time': sum(positions), 'speed': item.get('speed')})
+        return callback
+
+    return [for_job(n) for n in range(len(durations))]
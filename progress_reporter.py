@@ -0,0 +1,109 @@
+import time
+import asyncio
+import logging
+from typing import Dict, Optional
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from config import PROGRESS_EDIT_INTERVAL
+from user_manager import user_manager
+
+logger = logging.getLogger(__name__)
+
+def _format_eta(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60}s"
+    return f"{seconds}s"
+
+# Earliest monotonic time the next edit may go to each chat, shared by all
+# reporters so parallel jobs in one chat respect the same budget
+_next_edit: Dict[int, float] = {}
+
+class ProgressReporter:
+    """Coalesces progress for one status message into rate-limited edits"""
+    def __init__(self, bot, chat_id: int, message_id: int, user_id: int, title: str,
+                 min_interval: float = PROGRESS_EDIT_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.user_id = user_id
+        self.title = title
+        self.min_interval = min_interval
+        self.started = time.monotonic()
+        self._latest: Optional[tuple] = None
+        self._shown: Optional[str] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    def _eta(self, progress: float) -> Optional[float]:
+        elapsed = time.monotonic() - self.started
+        if progress <= 0 or progress >= 100 or elapsed < 1:
+            return None
+        return elapsed * (100 - progress) / progress
+
+    async def __call__(self, progress, status):
+        """Record progress; usable directly as a VideoProcessor progress_callback"""
+        eta = self._eta(progress)
+        user_manager.update_progress(self.user_id, progress, status, eta)
+        if self._closed:
+            return
+
+        self._latest = (progress, status, eta)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush())
+
+    async def _flush(self):
+        # Keep pushing until the newest state is on screen; reports that arrive
+        # while we wait simply replace _latest
+        while not self._closed and self._latest is not None:
+            delay = _next_edit.get(self.chat_id, 0) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            latest = self._latest
+            text = self._render(latest)
+            if text != self._shown:
+                await self._edit(text)
+            if self._latest is latest:
+                return
+
+    def _render(self, latest: tuple) -> str:
+        progress, status, eta = latest
+        text = f"{self.title} {progress}%\n{status}"
+        if eta is not None:
+            text += f"\n⏳ ETA: {_format_eta(eta)}"
+        return text
+
+    async def _edit(self, text: str):
+        _next_edit[self.chat_id] = time.monotonic() + self.min_interval
+        try:
+            await self.bot.edit_message_text(chat_id=self.chat_id, message_id=self.message_id, text=text)
+            self._shown = text
+        except RetryAfter as e:
+            _next_edit[self.chat_id] = time.monotonic() + e.retry_after
+            logger.warning(f"Progress edits rate-limited in chat {self.chat_id} for {e.retry_after}s")
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                logger.warning(f"Progress edit failed: {e}")
+        except TelegramError as e:
+            logger.warning(f"Progress edit failed: {e}")
+
+    async def finish(self):
+        """Show the final state right away instead of waiting out the interval"""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        if not self._closed and self._latest is not None:
+            text = self._render(self._latest)
+            if text != self._shown:
+                await self._edit(text)
+        await self.close()
+
+    async def close(self):
+        """Stop editing so the final result or error message isn't overwritten"""
+        self._closed = True
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        if _next_edit.get(self.chat_id, 0) <= time.monotonic():
+            _next_edit.pop(self.chat_id, None)
@@ -0,0 +1,74 @@
+import json
+import time
+import hashlib
+import sqlite3
+from typing import Optional, Tuple
+from config import RESULT_CACHE_PATH, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL
+
+class ResultCache:
+    """Maps (input file, operation, params) to the Telegram file_id of the result"""
+    def __init__(self, path: str = RESULT_CACHE_PATH, max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+                 ttl: float = RESULT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " file_id TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+
+    @staticmethod
+    def make_key(file_unique_id, operation: str, params: dict = None) -> Optional[str]:
+        """Stable cache key; None when the input has no file_unique_id"""
+        if not file_unique_id:
+            return None
+        raw = json.dumps([file_unique_id, operation, params or {}], sort_keys=True)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key: Optional[str]) -> Optional[Tuple[str, str]]:
+        """Return (kind, file_id) for a live entry and mark it recently used"""
+        if key is None:
+            return None
+        row = self._db.execute("SELECT kind, file_id, created FROM results WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None or now - row[2] > self.ttl:
+            if row is not None:
+                self.delete(key)
+            self.misses += 1
+            return None
+
+        self._db.execute("UPDATE results SET last_used = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return row[0], row[1]
+
+    def put(self, key: Optional[str], kind: str, file_id: str):
+        if key is None:
+            return
+        now = time.time()
+        self._db.execute(
+            "INSERT OR REPLACE INTO results (key, kind, file_id, created, last_used) VALUES (?, ?, ?, ?, ?)",
+            (key, kind, file_id, now, now)
+        )
+        self._evict(now)
+
+    def delete(self, key: str):
+        self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+
+    def _evict(self, now: float):
+        self._db.execute("DELETE FROM results WHERE created < ?", (now - self.ttl,))
+        # Drop least recently used entries beyond the size limit
+        self._db.execute(
+            "DELETE FROM results WHERE key IN ("
+            " SELECT key FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+result_cache = ResultCache()
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+from config import (
+    MAX_CONCURRENT_JOBS, MAX_JOBS_PER_USER, MAX_QUEUED_JOBS_PER_USER,
+    MAX_JOB_COST, HEAVY_JOB_COST, MAX_HEAVY_JOBS
+)
+
+logger = logging.getLogger(__name__)
+
+# Relative encode cost per second of one megapixel of input
+OPERATION_WEIGHTS = {
+    'convert': 1.0,
+    'batch': 1.5,
+    'merge': 1.0,
+    'split': 0.5,
+    'av_merge': 0.2,
+    'audio': 0.1,
+    'rename': 0.01,
+}
+
+# Audio-only inputs still cost something per second
+_MIN_MEGAPIXELS = 0.05
+
+class JobRejected(Exception):
+    """The job can never be admitted; the message is safe to show the user"""
+
+def estimate_cost(operation: str, infos: List[Dict]) -> float:
+    """Job cost in weighted megapixel-seconds from probed inputs"""
+    total = 0.0
+    for info in infos:
+        megapixels = _MIN_MEGAPIXELS
+        if info['video']:
+            video = info['video'][0]
+            megapixels = max(megapixels, (video['width'] or 0) * (video['height'] or 0) / 1_000_000)
+        total += info['duration'] * megapixels
+    return total * OPERATION_WEIGHTS.get(operation, 1.0)
+
+class _Ticket:
+    __slots__ = ('user_id', 'cost', 'started', 'on_position', 'position')
+
+    def __init__(self, user_id: int, cost: float, on_position):
+        self.user_id = user_id
+        self.cost = cost
+        self.started = asyncio.get_running_loop().create_future()
+        self.on_position = on_position
+        self.position = None
+
+    @property
+    def heavy(self) -> bool:
+        return self.cost > HEAVY_JOB_COST
+
+class JobScheduler:
+    """Admits jobs round-robin across users under global and per-user caps
+
+    Heavy jobs are deferred while MAX_HEAVY_JOBS of them are running, so a few
+    long encodes can't occupy every slot while short jobs wait.
+    """
+    def __init__(self, max_running: int = MAX_CONCURRENT_JOBS, max_per_user: int = MAX_JOBS_PER_USER,
+                 max_queued_per_user: int = MAX_QUEUED_JOBS_PER_USER, max_cost: float = MAX_JOB_COST,
+                 max_heavy: int = MAX_HEAVY_JOBS):
+        self.max_running = max(1, max_running)
+        self.max_per_user = max(1, max_per_user)
+        self.max_queued_per_user = max_queued_per_user
+        self.max_cost = max_cost
+        self.max_heavy = max(1, max_heavy)
+        self.running = 0
+        self.running_heavy = 0
+        self._running_per_user: Dict[int, int] = {}
+        self._queues: Dict[int, Deque[_Ticket]] = {}
+        # Round-robin turn of each active user's most recent start; users
+        # who were served longest ago (or never) go first
+        self._last_served: Dict[int, int] = {}
+        self._turn = 0
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _admit(self, user_id: int, cost: float):
+        if cost > self.max_cost:
+            raise JobRejected("This file is too long or too large to process. Try a shorter clip.")
+        if len(self._queues.get(user_id, ())) >= self.max_queued_per_user:
+            raise JobRejected("You already have too many jobs waiting. Please wait for them to finish.")
+
+    async def run(self, user_id: int, cost: float, job: Callable[[], Awaitable],
+                  on_position: Optional[Callable[[int], Awaitable]] = None):
+        """Wait for a fair turn, then run job(); raises JobRejected if it can never run"""
+        self._admit(user_id, cost)
+        ticket = _Ticket(user_id, cost, on_position)
+        self._queues.setdefault(user_id, deque()).append(ticket)
+        self._dispatch()
+
+        try:
+            await ticket.started
+        except asyncio.CancelledError:
+            self._remove(ticket)
+            raise
+
+        try:
+            return await job()
+        finally:
+            self._release(ticket)
+            self._dispatch()
+
+    def _release(self, ticket: _Ticket):
+        self.running -= 1
+        if ticket.heavy:
+            self.running_heavy -= 1
+        self._running_per_user[ticket.user_id] -= 1
+        if not self._running_per_user[ticket.user_id]:
+            del self._running_per_user[ticket.user_id]
+            if ticket.user_id not in self._queues:
+                self._last_served.pop(ticket.user_id, None)
+
+    def _remove(self, ticket: _Ticket):
+        queue = self._queues.get(ticket.user_id)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self._queues[ticket.user_id]
+                if ticket.user_id not in self._running_per_user:
+                    self._last_served.pop(ticket.user_id, None)
+        if ticket.started.done() and not ticket.started.cancelled():
+            # Started but cancelled before the job body ran; hand the slot back
+            self._release(ticket)
+        self._dispatch()
+
+    def _eligible(self, ticket: _Ticket) -> bool:
+        if self._running_per_user.get(ticket.user_id, 0) >= self.max_per_user:
+            return False
+        return not ticket.heavy or self.running_heavy < self.max_heavy
+
+    def _rotation(self) -> List[int]:
+        return sorted(self._queues, key=lambda user_id: self._last_served.get(user_id, 0))
+
+    def _dispatch(self):
+        while self.running < self.max_running:
+            for user_id in self._rotation():
+                if self._eligible(self._queues[user_id][0]):
+                    break
+            else:
+                break
+
+            queue = self._queues[user_id]
+            ticket = queue.popleft()
+            if not queue:
+                del self._queues[user_id]
+            self._turn += 1
+            self._last_served[user_id] = self._turn
+
+            self.running += 1
+            if ticket.heavy:
+                self.running_heavy += 1
+            self._running_per_user[user_id] = self._running_per_user.get(user_id, 0) + 1
+            ticket.started.set_result(None)
+
+        self._report_positions()
+
+    def _report_positions(self):
+        # Round-robin order: every user's first job, then every user's second...
+        queues = [self._queues[user_id] for user_id in self._rotation()]
+        position = 0
+        depth = 0
+        while queues:
+            remaining = []
+            for queue in queues:
+                position += 1
+                ticket = queue[depth]
+                if ticket.position != position and ticket.on_position is not None:
+                    ticket.position = position
+                    asyncio.get_running_loop().create_task(self._notify(ticket, position))
+                if len(queue) > depth + 1:
+                    remaining.append(queue)
+            queues = remaining
+            depth += 1
+
+    async def _notify(self, ticket: _Ticket, position: int):
+        try:
+            await ticket.on_position(position)
+        except Exception as e:
+            logger.warning(f"Queue position update failed: {e}")
+
+job_scheduler = JobScheduler()
@@ -1,46 +1,159 @@
-from typing import Dict, List
+from typing import Dict, List, Optional
+from collections import OrderedDict
+import json
+import time
 import asyncio
+import logging
+import sqlite3
+from config import SESSION_DB_PATH, SESSION_CACHE_SIZE, SESSION_TTL, SESSION_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+class Session:
+    """One user's conversation state"""
+    # Saved to disk; everything else only lives in memory
+    PERSISTED = ('state', 'queue', 'current_file', 'file_type', 'merge_audio', 'batch_formats')
+    __slots__ = PERSISTED + ('user_id', 'progress', 'updated')
+
+    def __init__(self, user_id: int, data: Optional[dict] = None, updated: float = 0.0):
+        data = data or {}
+        self.user_id = user_id
+        self.state: str = data.get('state', "idle")
+        self.queue: List[dict] = data.get('queue', [])
+        # Input refs (see bot.input_ref), not local paths
+        self.current_file: Optional[dict] = data.get('current_file')
+        self.file_type: Optional[str] = data.get('file_type')
+        self.merge_audio: Optional[dict] = data.get('merge_audio')
+        self.batch_formats: List[str] = data.get('batch_formats', [])
+        self.progress: Optional[Dict] = None
+        self.updated = updated
+
+    def to_json(self) -> str:
+        return json.dumps({name: getattr(self, name) for name in self.PERSISTED})
 
 class UserManager:
-    def __init__(self):
-        self.user_queues: Dict[int, List[dict]] = {}
-        self.user_states: Dict[int, str] = {}
-        self.progress_trackers: Dict[int, Dict] = {}
-        self.locks: Dict[int, asyncio.Lock] = {}
-    
-    def get_lock(self, user_id: int) -> asyncio.Lock:
-        if user_id not in self.locks:
-            self.locks[user_id] = asyncio.Lock()
-        return self.locks[user_id]
-    
+    """Per-user sessions: an LRU of recent users in memory over a SQLite table
+
+    Lookups for active users are a dict hit. Changes are marked dirty and
+    written in one transaction every SESSION_FLUSH_INTERVAL, and sessions idle
+    for longer than the TTL are dropped from disk.
+    """
+    def __init__(self, path: str = SESSION_DB_PATH, cache_size: int = SESSION_CACHE_SIZE,
+                 ttl: float = SESSION_TTL, flush_interval: float = SESSION_FLUSH_INTERVAL):
+        self.cache_size = max(1, cache_size)
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._sessions: "OrderedDict[int, Session]" = OrderedDict()
+        self._dirty: Dict[int, Session] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " user_id INTEGER PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+
+    def session(self, user_id: int) -> Session:
+        """The user's session, loaded from disk or created on first use"""
+        session = self._sessions.get(user_id)
+        if session is not None:
+            self._sessions.move_to_end(user_id)
+            return session
+
+        session = self._load(user_id)
+        self._sessions[user_id] = session
+        if len(self._sessions) > self.cache_size:
+            _, evicted = self._sessions.popitem(last=False)
+            if evicted.user_id in self._dirty:
+                # Write it out before it leaves memory
+                self.flush()
+        return session
+
+    def _load(self, user_id: int) -> Session:
+        row = self._db.execute("SELECT data, updated FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return Session(user_id)
+        try:
+            return Session(user_id, json.loads(row[0]), row[1])
+        except ValueError:
+            logger.warning(f"Discarding unreadable session of user {user_id}")
+            return Session(user_id)
+
+    def update(self, user_id: int, **fields):
+        """Set session fields and schedule them for writing"""
+        session = self.session(user_id)
+        for name, value in fields.items():
+            setattr(session, name, value)
+        self._mark_dirty(session)
+
+    def _mark_dirty(self, session: Session):
+        session.updated = time.time()
+        self._dirty[session.user_id] = session
+
+    def flush(self):
+        """Write all pending changes in a single transaction"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        rows = [(session.user_id, session.to_json(), session.updated) for session in dirty.values()]
+        try:
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO sessions (user_id, data, updated) VALUES (?, ?, ?)", rows
+                )
+                self._db.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self.ttl,))
+        except sqlite3.Error as e:
+            logger.error(f"Session flush failed: {e}")
+            # Keep anything not re-dirtied meanwhile for the next attempt
+            for user_id, session in dirty.items():
+                self._dirty.setdefault(user_id, session)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    def stop(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        self.flush()
+
     def set_user_state(self, user_id: int, state: str):
-        self.user_states[user_id] = state
-    
+        self.update(user_id, state=state)
+
     def get_user_state(self, user_id: int) -> str:
-        return self.user_states.get(user_id, "idle")
-    
+        return self.session(user_id).state
+
     def add_to_queue(self, user_id: int, task: dict):
-        if user_id not in self.user_queues:
-            self.user_queues[user_id] = []
-        self.user_queues[user_id].append(task)
-    
+        session = self.session(user_id)
+        session.queue.append(task)
+        self._mark_dirty(session)
+
     def get_queue(self, user_id: int) -> List[dict]:
-        return self.user_queues.get(user_id, [])
-    
+        return self.session(user_id).queue
+
     def clear_queue(self, user_id: int):
-        if user_id in self.user_queues:
-            self.user_queues[user_id].clear()
-    
-    def update_progress(self, user_id: int, progress: float, status: str):
-        if user_id not in self.progress_trackers:
-            self.progress_trackers[user_id] = {}
-        self.progress_trackers[user_id] = {
+        self.update(user_id, queue=[])
+
+    def update_progress(self, user_id: int, progress: float, status: str, eta: Optional[float] = None):
+        self.session(user_id).progress = {
             'progress': progress,
             'status': status,
+            'eta': eta,
             'timestamp': asyncio.get_event_loop().time()
         }
-    
+
     def get_progress(self, user_id: int) -> Dict:
-        return self.progress_trackers.get(user_id, {'progress': 0, 'status': 'Idle'})
+        return self.session(user_id).progress or {'progress': 0, 'status': 'Idle'}
 
 user_manager = UserManager()
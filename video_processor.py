@@ -1,23 +1,104 @@
 import os
 import asyncio
-from moviepy.editor import VideoFileClip, AudioFileClip, concatenate_videoclips
-from pydub import AudioSegment
 import ffmpeg
-import aiofiles
-from config import TEMP_DIR
+from config import MAX_WORKERS, CHUNKED_MIN_DURATION, CHUNK_MIN_SECONDS
+from executor import job_executor
+from media_probe import (
+    probe_media, select_convert_mode, codecs_fit_container, audio_fits_format,
+    keyframe_index, plan_merge, plan_chunks
+)
+import ffmpeg_ops
+import backends
+import progress
+
+# Blocking encode steps. These run inside the worker pool, so they must stay
+# module-level functions that only take picklable arguments. Full re-encodes
+# go through backends.run(), which loads the configured library on demand.
+
+def _remux_or_convert(input_path: str, output_path: str):
+    try:
+        ffmpeg_ops.remux(input_path, output_path)
+    except ffmpeg.Error:
+        # Some sources have timestamps the target muxer rejects; re-encode instead
+        backends.run('convert', input_path, output_path)
+
+def _split(input_path: str, start_time: float, end_time: float, output_path: str) -> str:
+    info = probe_media(input_path)
+    if info['duration']:
+        end_time = min(end_time, info['duration'])
+    
+    container = os.path.splitext(output_path)[1].lstrip('.').lower()
+    video = info['video'][0] if info['video'] else None
+    if (video and video['codec'] in ffmpeg_ops.SMART_CUT_ENCODERS
+            and codecs_fit_container({'video': [video], 'audio': []}, container)):
+        try:
+            keyframes = keyframe_index(input_path)
+            ffmpeg_ops.smart_cut(
+                input_path, start_time, end_time, output_path,
+                keyframes, video, bool(info['audio'])
+            )
+            return 'smart'
+        except ffmpeg.Error:
+            pass
+    
+    backends.run('split', input_path, start_time, end_time, output_path)
+    return 'full'
+
+def _mux_video_audio(video_path: str, audio_path: str, output_path: str, duration_mode: str):
+    video_info = probe_media(video_path)
+    audio_info = probe_media(audio_path)
+    container = os.path.splitext(output_path)[1].lstrip('.').lower()
+    
+    copy_audio = codecs_fit_container({'video': [], 'audio': audio_info['audio'][:1]}, container)
+    pad_seconds = max(0.0, video_info['duration'] - audio_info['duration'])
+    try:
+        ffmpeg_ops.replace_audio(
+            video_path, audio_path, output_path, copy_audio, duration_mode, pad_seconds
+        )
+    except ffmpeg.Error:
+        backends.run('av_merge', video_path, audio_path, output_path)
+
+def _encoder_progress(progress_callback, duration: float, start: int, end: int, status: str):
+    if progress_callback is None:
+        return None
+    return progress.encoder_progress(progress_callback, duration, start, end, status)
 
 class VideoProcessor:
     @staticmethod
-    async def convert_video(input_path: str, output_format: str, progress_callback=None) -> str:
+    async def convert_video(input_path: str, output_format: str, output_dir: str, progress_callback=None) -> str:
         """Convert video to different format"""
-        output_path = os.path.join(TEMP_DIR, f"converted_{os.path.basename(input_path).split('.')[0]}.{output_format}")
+        output_path = os.path.join(output_dir, f"converted_{os.path.basename(input_path).split('.')[0]}.{output_format}")
         
         if progress_callback:
-            await progress_callback(10, "Starting conversion...")
+            await progress_callback(10, "Analyzing streams...")
+        
+        info = await asyncio.to_thread(probe_media, input_path)
+        chunked_min_duration = None
+        if MAX_WORKERS > 1 and output_format in ffmpeg_ops.CHUNK_ENCODERS:
+            chunked_min_duration = CHUNKED_MIN_DURATION
+        mode = select_convert_mode(info, output_format, chunked_min_duration)
         
-        clip = VideoFileClip(input_path)
-        clip.write_videofile(output_path, verbose=False, logger=None)
-        clip.close()
+        if mode == 'chunked':
+            try:
+                await VideoProcessor._convert_chunked(input_path, output_path, output_format, info, progress_callback)
+            except ffmpeg.Error:
+                # Fall back to a single-pass transcode
+                mode = 'transcode'
+        
+        if mode == 'remux':
+            if progress_callback:
+                await progress_callback(30, "Remuxing streams (no re-encode)...")
+            await job_executor.submit(
+                _remux_or_convert, input_path, output_path,
+                progress=_encoder_progress(progress_callback, info['duration'], 30, 95, "Remuxing streams...")
+            )
+        elif mode == 'transcode':
+            if progress_callback:
+                await progress_callback(30, "Transcoding video...")
+            await job_executor.submit(
+                backends.run, 'convert', input_path, output_path,
+                progress=_encoder_progress(progress_callback, info['duration'], 30, 95, "Transcoding video...")
+            )
         
         if progress_callback:
             await progress_callback(100, "Conversion completed!")
@@ -25,28 +106,147 @@ class VideoProcessor:
         return output_path
 
     @staticmethod
-    async def merge_videos(video_paths: list, progress_callback=None) -> str:
-        """Merge multiple videos"""
-        output_path = os.path.join(TEMP_DIR, "merged_video.mp4")
+    async def _convert_chunked(input_path: str, output_path: str, output_format: str, info: dict,
+                               progress_callback=None):
+        """Transcode keyframe-aligned chunks in parallel and join them losslessly"""
+        video_encoder, audio_encoder = ffmpeg_ops.CHUNK_ENCODERS[output_format]
+        keyframes = await asyncio.to_thread(keyframe_index, input_path)
+        chunks = plan_chunks(keyframes, info['duration'], MAX_WORKERS, CHUNK_MIN_SECONDS)
+        # Split the cores between the chunk encoders running side by side
+        threads = max(1, (os.cpu_count() or 1) // MAX_WORKERS)
         
         if progress_callback:
-            await progress_callback(10, "Loading videos...")
+            await progress_callback(30, f"Transcoding {len(chunks)} chunks in parallel...")
         
-        clips = []
-        for i, path in enumerate(video_paths):
+        callbacks = [None] * len(chunks)
+        if progress_callback:
+            callbacks = progress.parallel_progress(
+                progress_callback, [end - start for start, end in chunks], 30, 90, "Transcoding chunks..."
+            )
+        
+        audio_path = f"{output_path}.audio.{'mp3' if audio_encoder == 'libmp3lame' else 'm4a'}"
+        video_path = f"{output_path}.video.ts"
+        segments = [f"{output_path}.chunk{i}.ts" for i in range(len(chunks))]
+        try:
+            jobs = [
+                job_executor.submit(
+                    ffmpeg_ops.encode_chunk, input_path, start, end, segment,
+                    video_encoder, threads, progress=callback
+                )
+                for (start, end), segment, callback in zip(chunks, segments, callbacks)
+            ]
+            if info['audio']:
+                jobs.append(job_executor.submit(ffmpeg_ops.encode_audio, input_path, audio_path, audio_encoder))
+            await asyncio.gather(*jobs)
+            
             if progress_callback:
-                await progress_callback(10 + (i * 30 // len(video_paths)), f"Loading video {i+1}...")
-            clips.append(VideoFileClip(path))
+                await progress_callback(90, "Joining chunks...")
+            
+            if info['audio']:
+                await job_executor.submit(ffmpeg_ops.concat_copy, segments, video_path)
+                await job_executor.submit(ffmpeg_ops.replace_audio, video_path, audio_path, output_path, True)
+            else:
+                await job_executor.submit(ffmpeg_ops.concat_copy, segments, output_path)
+        finally:
+            for path in segments + [audio_path, video_path]:
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    @staticmethod
+    async def batch_convert(input_path: str, video_formats: list, audio_formats: list, output_dir: str,
+                            progress_callback=None) -> dict:
+        """Convert to several video and audio formats from one decode
+
+        Returns {'video': {format: path}, 'audio': {format: path}}.
+        """
+        if progress_callback:
+            await progress_callback(10, "Analyzing streams...")
+        
+        info = await asyncio.to_thread(probe_media, input_path)
+        if not info['video']:
+            video_formats = []
+        if not info['audio']:
+            audio_formats = []
+        if not video_formats and not audio_formats:
+            raise ValueError(f"Nothing to convert in {input_path}")
+        
+        video_targets = {fmt: os.path.join(output_dir, f"converted.{fmt}") for fmt in video_formats}
+        audio_targets = {fmt: os.path.join(output_dir, f"audio.{fmt}") for fmt in audio_formats}
+        video_copy = [fmt for fmt in video_formats if select_convert_mode(info, fmt) == 'remux']
+        audio_copy = [fmt for fmt in audio_formats if audio_fits_format(info, fmt)]
         
         if progress_callback:
-            await progress_callback(70, "Merging videos...")
+            await progress_callback(20, f"Converting to {len(video_targets) + len(audio_targets)} formats...")
         
-        final_clip = concatenate_videoclips(clips)
-        final_clip.write_videofile(output_path, verbose=False, logger=None)
+        await job_executor.submit(
+            ffmpeg_ops.batch_convert, input_path, video_targets, audio_targets, video_copy, audio_copy,
+            progress=_encoder_progress(progress_callback, info['duration'], 20, 95, "Converting...")
+        )
         
-        for clip in clips:
-            clip.close()
-        final_clip.close()
+        if progress_callback:
+            await progress_callback(100, "Conversion completed!")
+        
+        return {'video': video_targets, 'audio': audio_targets}
+
+    @staticmethod
+    async def merge_videos(video_paths: list, output_dir: str, progress_callback=None) -> str:
+        """Merge multiple videos"""
+        output_path = os.path.join(output_dir, "merged.mp4")
+        
+        if progress_callback:
+            await progress_callback(10, "Analyzing videos...")
+        
+        infos = await asyncio.gather(*(asyncio.to_thread(probe_media, path) for path in video_paths))
+        plan = plan_merge(
+            infos,
+            ffmpeg_ops.NORMALIZE_VIDEO_ENCODERS,
+            ffmpeg_ops.NORMALIZE_AUDIO_ENCODERS
+        )
+        
+        segments = list(video_paths)
+        normalized = []
+        try:
+            if plan['normalize']:
+                if progress_callback:
+                    await progress_callback(
+                        30, f"Normalizing {len(plan['normalize'])} of {len(video_paths)} videos..."
+                    )
+                callbacks = [None] * len(plan['normalize'])
+                if progress_callback:
+                    callbacks = progress.parallel_progress(
+                        progress_callback, [infos[i]['duration'] for i in plan['normalize']],
+                        30, 70, "Normalizing videos..."
+                    )
+                jobs = []
+                for i, callback in zip(plan['normalize'], callbacks):
+                    path = f"{output_path}.norm{i}.mp4"
+                    normalized.append(path)
+                    segments[i] = path
+                    jobs.append(job_executor.submit(
+                        ffmpeg_ops.normalize, video_paths[i], path,
+                        plan['target'], bool(infos[i]['audio']),
+                        progress=callback
+                    ))
+                await asyncio.gather(*jobs)
+            
+            if progress_callback:
+                await progress_callback(70, "Joining videos...")
+            
+            total_duration = sum(info['duration'] for info in infos)
+            try:
+                await job_executor.submit(
+                    ffmpeg_ops.concat_join, segments, output_path, plan['target']['video']['codec'],
+                    progress=_encoder_progress(progress_callback, total_duration, 70, 95, "Joining videos...")
+                )
+            except ffmpeg.Error:
+                await job_executor.submit(
+                    backends.run, 'merge', list(video_paths), output_path,
+                    progress=_encoder_progress(progress_callback, total_duration, 70, 95, "Re-encoding merge...")
+                )
+        finally:
+            for path in normalized:
+                if os.path.exists(path):
+                    os.unlink(path)
         
         if progress_callback:
             await progress_callback(100, "Merge completed!")
@@ -54,22 +254,25 @@ class VideoProcessor:
         return output_path
 
     @staticmethod
-    async def video_to_audio(input_path: str, audio_format: str, progress_callback=None) -> str:
-        """Extract audio from video"""
-        output_path = os.path.join(TEMP_DIR, f"audio_{os.path.basename(input_path).split('.')[0]}.{audio_format}")
+    async def video_to_audio(input_path: str, audio_format: str, output_dir: str, progress_callback=None) -> str:
+        """Extract audio from a video or audio file"""
+        output_path = os.path.join(output_dir, f"audio_{os.path.basename(input_path).split('.')[0]}.{audio_format}")
         
         if progress_callback:
-            await progress_callback(20, "Extracting audio...")
+            await progress_callback(20, "Analyzing audio...")
         
-        video = VideoFileClip(input_path)
-        audio = video.audio
+        info = await asyncio.to_thread(probe_media, input_path)
+        if not info['audio']:
+            raise ValueError(f"No audio stream in {input_path}")
+        copy_audio = audio_fits_format(info, audio_format)
         
         if progress_callback:
-            await progress_callback(60, "Saving audio file...")
+            await progress_callback(50, "Copying audio stream..." if copy_audio else "Encoding audio...")
         
-        audio.write_audiofile(output_path, verbose=False, logger=None)
-        video.close()
-        audio.close()
+        await job_executor.submit(
+            backends.run, 'audio', input_path, output_path, audio_format, copy_audio,
+            progress=_encoder_progress(progress_callback, info['duration'], 50, 95, "Extracting audio...")
+        )
         
         if progress_callback:
             await progress_callback(100, "Audio extraction completed!")
@@ -77,49 +280,100 @@ class VideoProcessor:
         return output_path
 
     @staticmethod
-    async def split_video(input_path: str, start_time: float, end_time: float, progress_callback=None) -> str:
+    async def split_video(input_path: str, start_time: float, end_time: float, output_dir: str,
+                          progress_callback=None) -> str:
         """Split video by time range"""
-        output_path = os.path.join(TEMP_DIR, f"split_{os.path.basename(input_path)}")
+        output_path = os.path.join(output_dir, f"split_{os.path.basename(input_path)}")
         
         if progress_callback:
-            await progress_callback(20, "Loading video...")
+            await progress_callback(20, "Cutting video at keyframes...")
         
-        clip = VideoFileClip(input_path)
+        await job_executor.submit(
+            _split, input_path, start_time, end_time, output_path,
+            progress=_encoder_progress(progress_callback, end_time - start_time, 20, 95, "Cutting video...")
+        )
         
         if progress_callback:
-            await progress_callback(50, "Cutting video...")
+            await progress_callback(100, "Video split completed!")
         
-        subclip = clip.subclip(start_time, end_time)
-        subclip.write_videofile(output_path, verbose=False, logger=None)
+        return output_path
+
+    @staticmethod
+    async def split_video_ranges(input_path: str, ranges: list, output_dir: str, progress_callback=None) -> list:
+        """Cut several time ranges from one pass over the video"""
         
-        clip.close()
-        subclip.close()
+        if progress_callback:
+            await progress_callback(10, "Analyzing video...")
+        
+        info = await asyncio.to_thread(probe_media, input_path)
+        if info['duration']:
+            ranges = [(start, min(end, info['duration'])) for start, end in ranges]
+        output_paths = [os.path.join(output_dir, f"clip_{i + 1:03d}.mp4") for i in range(len(ranges))]
+        span = max(end for _, end in ranges) - min(start for start, _ in ranges)
+        
+        if progress_callback:
+            await progress_callback(20, f"Cutting {len(ranges)} clips...")
+        
+        await job_executor.submit(
+            ffmpeg_ops.split_ranges, input_path, ranges, output_paths, bool(info['audio']),
+            progress=_encoder_progress(progress_callback, span, 20, 95, f"Cutting {len(ranges)} clips...")
+        )
         
         if progress_callback:
             await progress_callback(100, "Video split completed!")
         
-        return output_path
+        return output_paths
 
     @staticmethod
-    async def merge_video_audio(video_path: str, audio_path: str, progress_callback=None) -> str:
-        """Merge video with external audio"""
-        output_path = os.path.join(TEMP_DIR, f"merged_av_{os.path.basename(video_path)}")
+    async def split_video_segments(input_path: str, segment_length: float, output_dir: str,
+                                   progress_callback=None) -> list:
+        """Cut the whole video into consecutive clips of segment_length seconds"""
         
         if progress_callback:
-            await progress_callback(20, "Loading files...")
+            await progress_callback(10, "Analyzing video...")
         
-        video_clip = VideoFileClip(video_path)
-        audio_clip = AudioFileClip(audio_path)
+        info = await asyncio.to_thread(probe_media, input_path)
         
         if progress_callback:
-            await progress_callback(60, "Merging audio and video...")
+            await progress_callback(20, "Cutting segments...")
         
-        final_clip = video_clip.set_audio(audio_clip)
-        final_clip.write_videofile(output_path, verbose=False, logger=None)
+        await job_executor.submit(
+            ffmpeg_ops.split_segments, input_path, segment_length,
+            os.path.join(output_dir, "clip_%03d.mp4"),
+            progress=_encoder_progress(progress_callback, info['duration'], 20, 95, "Cutting segments...")
+        )
         
-        video_clip.close()
-        audio_clip.close()
-        final_clip.close()
+        if progress_callback:
+            await progress_callback(100, "Video split completed!")
+        
+        return sorted(
+            os.path.join(output_dir, name) for name in os.listdir(output_dir)
+            if name.startswith("clip_") and name.endswith(".mp4")
+        )
+
+    @staticmethod
+    async def merge_video_audio(video_path: str, audio_path: str, output_dir: str, duration_mode: str = 'shortest',
+                                progress_callback=None) -> str:
+        """Merge video with external audio, copying the video stream"""
+        name, ext = os.path.splitext(os.path.basename(video_path))
+        
+        if progress_callback:
+            await progress_callback(20, "Analyzing streams...")
+        
+        info = await asyncio.to_thread(probe_media, video_path)
+        container = ext.lstrip('.').lower()
+        if not codecs_fit_container({'video': info['video'][:1], 'audio': []}, container):
+            # Matroska takes any video codec, so the picture never needs re-encoding
+            ext = '.mkv'
+        output_path = os.path.join(output_dir, f"merged_av_{name}{ext}")
+        
+        if progress_callback:
+            await progress_callback(50, "Muxing new soundtrack...")
+        
+        await job_executor.submit(
+            _mux_video_audio, video_path, audio_path, output_path, duration_mode,
+            progress=_encoder_progress(progress_callback, info['duration'], 50, 95, "Muxing new soundtrack...")
+        )
         
         if progress_callback:
             await progress_callback(100, "Merge completed!")
@@ -127,9 +381,18 @@ class VideoProcessor:
         return output_path
 
     @staticmethod
-    async def rename_file(input_path: str, new_name: str) -> str:
-        """Simple file rename"""
+    async def rename_file(input_path: str, new_name: str, output_dir: str) -> str:
+        """Simple file rename
+
+        Hardlinks the input under the new name, so no bytes are copied; the
+        link also keeps the data alive if the input store evicts the original.
+        """
         import shutil
-        output_path = os.path.join(TEMP_DIR, new_name)
-        shutil.copy2(input_path, output_path)
+        # basename() keeps a name like "../x" inside the job's directory
+        output_path = os.path.join(output_dir, os.path.basename(new_name))
+        try:
+            os.link(input_path, output_path)
+        except OSError:
+            # Different filesystem, or one without hardlinks
+            await asyncio.to_thread(shutil.copy2, input_path, output_path)
         return output_path
@@ -0,0 +1,184 @@
+"""Webhook mode: a small asyncio HTTP server feeding the Application
+
+Telegram POSTs each update to WEBHOOK_PATH with our secret token in a header;
+GET /healthz answers while the event loop is responsive. To try it locally,
+leave WEBHOOK_URL unset, set WEBHOOK_SECRET and POST a recorded update:
+
+    curl -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \\
+         -H "Content-Type: application/json" -d @update.json \\
+         http://localhost:8080/telegram
+"""
+import hmac
+import json
+import signal
+import asyncio
+import logging
+import secrets
+from typing import Awaitable, Callable, Dict, Tuple
+from telegram import Update
+from telegram.ext import Application
+from config import WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS, PORT
+
+logger = logging.getLogger(__name__)
+
+# Updates are small; anything bigger is not from Telegram
+MAX_BODY_BYTES = 1024 * 1024
+REQUEST_TIMEOUT = 30  # seconds
+
+_REASONS = {
+    200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+    405: "Method Not Allowed", 413: "Payload Too Large", 503: "Service Unavailable",
+}
+
+# (status, content type, body)
+Response = Tuple[int, str, bytes]
+Handler = Callable[[Dict[str, str], bytes], Awaitable[Response]]
+
+def _text(status: int, body: str = None) -> Response:
+    return status, "text/plain; charset=utf-8", (body or _REASONS.get(status, "")).encode()
+
+class WebhookServer:
+    """Minimal HTTP/1.1 server with keep-alive and a method/path route table"""
+    def __init__(self, host: str = "0.0.0.0", port: int = PORT):
+        self.host = host
+        self.port = port
+        self._routes: Dict[Tuple[str, str], Handler] = {}
+        self._server: asyncio.AbstractServer = None
+
+    def add_route(self, method: str, path: str, handler: Handler):
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        logger.info(f"Listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request = await asyncio.wait_for(self._read_request(reader), REQUEST_TIMEOUT)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                if body is None:
+                    # Too big to read, so the stream can't be reused either
+                    await self._respond(writer, _text(413), keep_alive=False)
+                    break
+                response = await self._dispatch(method, path, headers, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self._respond(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        line = await reader.readline()
+        if not line:
+            return None
+        method, target, _ = line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length', 0))
+        body = None
+        if length <= MAX_BODY_BYTES:
+            body = await reader.readexactly(length) if length else b''
+        return method.upper(), target.split('?', 1)[0], headers, body
+
+    async def _dispatch(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> Response:
+        handler = self._routes.get((method, path))
+        if handler is None:
+            if any(route_path == path for _, route_path in self._routes):
+                return _text(405)
+            return _text(404)
+        try:
+            return await handler(headers, body)
+        except Exception as e:
+            logger.error(f"Error handling {method} {path}: {e}")
+            return _text(503)
+
+    async def _respond(self, writer: asyncio.StreamWriter, response: Response, keep_alive: bool):
+        status, content_type, body = response
+        head = (
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+def telegram_route(application: Application, secret_token: str) -> Handler:
+    """Route handler that verifies the secret and queues the update"""
+    async def handle(headers: Dict[str, str], body: bytes) -> Response:
+        sent = headers.get('x-telegram-bot-api-secret-token', '')
+        if not hmac.compare_digest(sent.encode(), secret_token.encode()):
+            return _text(403)
+        try:
+            update = Update.de_json(json.loads(body), application.bot)
+        except ValueError:
+            return _text(400)
+        if update is None:
+            return _text(400)
+        # Telegram only needs the 200; handlers run on their own tasks
+        await application.update_queue.put(update)
+        return _text(200)
+    return handle
+
+async def healthz(headers: Dict[str, str], body: bytes) -> Response:
+    return _text(200, "ok")
+
+async def serve(application: Application, server: WebhookServer = None):
+    """Run the application behind the webhook server until SIGINT/SIGTERM"""
+    secret_token = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    server = server or WebhookServer()
+    server.add_route('POST', WEBHOOK_PATH, telegram_route(application, secret_token))
+    server.add_route('GET', '/healthz', healthz)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await application.initialize()
+    try:
+        # run_polling() would call these for us
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+                secret_token=secret_token,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+            )
+        else:
+            logger.warning("WEBHOOK_URL is not set; not registering the webhook with Telegram")
+        await stop.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+def run_webhook(application: Application):
+    asyncio.run(serve(application))
@@ -0,0 +1,112 @@
+"""Encode worker: runs jobs that the bot queued in the broker
+
+Start any number of these next to the bot (JOB_BACKEND=broker), on the
+same host and from the same working directory:
+
+    python worker.py
+
+The broker is a SQLite database in WAL mode, which relies on shared memory
+and file locks that network filesystems don't provide. Workers on other
+machines mounting DATA_DIR over NFS/SMB would corrupt the queue, so the
+broker only supports a single host.
+"""
+import os
+import time
+import socket
+import signal
+import asyncio
+import logging
+from config import WORKER_JOBS, WORKER_HEARTBEAT_TIMEOUT, BROKER_POLL_INTERVAL
+from broker import Broker
+from executor import job_executor
+from jobs import run_operation
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Progress is written at most this often per job
+PROGRESS_INTERVAL = 1.0  # seconds
+
+class Worker:
+    def __init__(self, broker: Broker, jobs: int = WORKER_JOBS):
+        self.broker = broker
+        self.name = f"{socket.gethostname()}-{os.getpid()}"
+        self.slots = asyncio.Semaphore(max(1, jobs))
+        self.running = set()
+
+    async def run(self, stop: asyncio.Event):
+        logger.info(f"Worker {self.name} started")
+        while not stop.is_set():
+            await self.slots.acquire()
+            job = self.broker.claim(self.name)
+            if job is None:
+                self.slots.release()
+                try:
+                    await asyncio.wait_for(stop.wait(), BROKER_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.get_running_loop().create_task(self._run_job(job))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+        # Let jobs in flight finish so they are not retried elsewhere
+        if self.running:
+            await asyncio.gather(*self.running, return_exceptions=True)
+
+    async def _run_job(self, job: dict):
+        job_id = job['id']
+        logger.info(f"Running {job['method']} job {job_id} ({job['profile'] or 'default'} profile)")
+        last_write = 0.0
+        revoked = False
+
+        def revoke():
+            # The bot cancelled the job or it was handed to another worker
+            nonlocal revoked
+            if not revoked:
+                revoked = True
+                work.cancel()
+
+        async def report(progress, status):
+            nonlocal last_write
+            if time.monotonic() - last_write >= PROGRESS_INTERVAL:
+                last_write = time.monotonic()
+                if not self.broker.heartbeat(job_id, self.name, progress, status):
+                    revoke()
+
+        loop = asyncio.get_running_loop()
+        work = loop.create_task(run_operation(job['method'], job['args'], report, job['profile']))
+        heartbeat = loop.create_task(self._heartbeat(job_id, revoke))
+        try:
+            result = await work
+            self.broker.complete(job_id, self.name, result)
+        except asyncio.CancelledError:
+            if not revoked:
+                raise
+            logger.info(f"Job {job_id} was cancelled")
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            self.broker.fail(job_id, self.name, str(e))
+        finally:
+            heartbeat.cancel()
+            self.slots.release()
+
+    async def _heartbeat(self, job_id: str, revoke):
+        while True:
+            await asyncio.sleep(WORKER_HEARTBEAT_TIMEOUT / 3)
+            if not self.broker.heartbeat(job_id, self.name):
+                revoke()
+                return
+
+async def main():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await Worker(Broker()).run(stop)
+    finally:
+        job_executor.shutdown(wait=False)
+
+if __name__ == "__main__":
+    asyncio.run(main())
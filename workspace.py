@@ -0,0 +1,127 @@
+import os
+import time
+import uuid
+import shutil
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict
+from config import TEMP_DIR, INPUT_CACHE_DIR, JOBS_DIR, WORKSPACE_MAX_AGE, WORKSPACE_MAX_BYTES, JANITOR_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def _remove(path: str):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+class WorkspaceManager:
+    """Gives every job its own directory and makes sure it gets deleted
+
+    Directories are removed when the job's block exits, however it exits. A
+    background janitor also deletes directories that outlive WORKSPACE_MAX_AGE
+    or push the total over WORKSPACE_MAX_BYTES, and anything left from before
+    a restart is reclaimed on startup.
+    """
+    def __init__(self, root: str = JOBS_DIR, max_age: float = WORKSPACE_MAX_AGE,
+                 max_bytes: int = WORKSPACE_MAX_BYTES, interval: float = JANITOR_INTERVAL):
+        self.root = root
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.interval = interval
+        # Directory name -> creation time for jobs still running
+        self._active: Dict[str, float] = {}
+        self._janitor: asyncio.Task = None
+        os.makedirs(root, exist_ok=True)
+
+    @asynccontextmanager
+    async def job(self):
+        """Yield a fresh, empty directory that is deleted when the block exits"""
+        name = uuid.uuid4().hex
+        path = os.path.join(self.root, name)
+        # Registered first: a sweep running in a thread must never see the
+        # new directory as an orphan
+        self._active[name] = time.time()
+        try:
+            os.makedirs(path)
+            yield path
+        finally:
+            del self._active[name]
+            await asyncio.to_thread(_remove, path)
+
+    @property
+    def active_jobs(self) -> int:
+        return len(self._active)
+
+    def reclaim_orphans(self):
+        """Delete job directories and stray temp files left by a previous run"""
+        keep = {os.path.abspath(self.root), os.path.abspath(INPUT_CACHE_DIR)}
+        for name in os.listdir(TEMP_DIR):
+            path = os.path.join(TEMP_DIR, name)
+            if os.path.abspath(path) not in keep:
+                logger.info(f"Reclaiming stray temp file {path}")
+                _remove(path)
+        for name in os.listdir(self.root):
+            if name not in self._active:
+                logger.info(f"Reclaiming orphaned workspace {name}")
+                _remove(os.path.join(self.root, name))
+
+    def sweep(self):
+        """Enforce the age and size quotas once"""
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            created = self._active.get(name)
+            if created is None:
+                # Not ours (or its job already finished): an orphan
+                _remove(path)
+                continue
+            if now - created > self.max_age:
+                logger.warning(f"Workspace {name} exceeded {self.max_age:.0f}s, removing")
+                _remove(path)
+                continue
+            entries.append((created, path, _dir_size(path)))
+
+        total = sum(size for _, _, size in entries)
+        # Over budget: drop the oldest jobs first, they are most likely stuck
+        for created, path, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            logger.warning(f"Workspaces over {self.max_bytes} bytes, removing {path}")
+            _remove(path)
+            total -= size
+
+    async def run_janitor(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logger.error(f"Workspace janitor error: {e}")
+
+    def start(self):
+        self.reclaim_orphans()
+        if self._janitor is None:
+            self._janitor = asyncio.get_running_loop().create_task(self.run_janitor())
+
+    def stop(self):
+        if self._janitor is not None:
+            self._janitor.cancel()
+            self._janitor = None
+
+workspace_manager = WorkspaceManager()